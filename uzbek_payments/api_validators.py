@@ -13,6 +13,12 @@ from frappe import _
 class APIResponseValidator:
 	"""Validate API responses"""
 
+	_PAYME_REQUIRED_ROOT = frozenset({"result"})
+	_PAYME_REQUIRED_RESULT = frozenset({"checkout_url", "id"})
+	_CLICK_REQUIRED = frozenset({"click_trans_id"})
+	_CLICK_URL_KEYS = frozenset({"payment_url", "redirect_url"})
+	_FREEDOMPAY_REQUIRED = frozenset({"payment_url", "payment_id"})
+
 	@staticmethod
 	def validate_payme_response(response: Dict[str, Any]) -> bool:
 		"""
@@ -27,15 +33,14 @@ class APIResponseValidator:
 		if not response:
 			frappe.throw(_("Empty response from Payme API"))
 		
-		if "result" not in response:
+		if not APIResponseValidator._PAYME_REQUIRED_ROOT.issubset(response.keys()):
 			frappe.throw(_("Invalid Payme API response format"))
 		
-		result = response.get("result", {})
-		
-		if "checkout_url" not in result:
-			frappe.throw(_("Missing checkout_url in Payme response"))
-		
-		if "id" not in result:
+		result = response["result"]
+		if not isinstance(result, dict) or not APIResponseValidator._PAYME_REQUIRED_RESULT.issubset(result.keys()):
+			# Rare failure path: work out which key is missing
+			if not isinstance(result, dict) or "checkout_url" not in result:
+				frappe.throw(_("Missing checkout_url in Payme response"))
 			frappe.throw(_("Missing payment id in Payme response"))
 		
 		return True
@@ -54,10 +59,11 @@ class APIResponseValidator:
 		if not response:
 			frappe.throw(_("Empty response from Click API"))
 		
-		if "click_trans_id" not in response:
+		keys = response.keys()
+		if not APIResponseValidator._CLICK_REQUIRED.issubset(keys):
 			frappe.throw(_("Missing click_trans_id in Click response"))
 		
-		if "payment_url" not in response and "redirect_url" not in response:
+		if APIResponseValidator._CLICK_URL_KEYS.isdisjoint(keys):
 			frappe.throw(_("Missing payment URL in Click response"))
 		
 		return True
@@ -76,10 +82,10 @@ class APIResponseValidator:
 		if not response:
 			frappe.throw(_("Empty response from FreedomPay API"))
 		
-		if "payment_url" not in response:
-			frappe.throw(_("Missing payment_url in FreedomPay response"))
-		
-		if "payment_id" not in response:
+		if not APIResponseValidator._FREEDOMPAY_REQUIRED.issubset(response.keys()):
+			# Rare failure path: work out which key is missing
+			if "payment_url" not in response:
+				frappe.throw(_("Missing payment_url in FreedomPay response"))
 			frappe.throw(_("Missing payment_id in FreedomPay response"))
 		
 		return True
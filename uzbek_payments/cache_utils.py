@@ -6,8 +6,61 @@ Cache utilities for payment gateways
 """
 
 import frappe
+from frappe.utils.caching import redis_cache, site_cache
 from typing import Optional, Dict, Any
 
+_cache = None
+
+
+def get_cache():
+	"""
+	Get Redis cache client, resolved once per process
+	
+	frappe.cache() returns a process-wide client, so it is safe to keep;
+	keys stay site-scoped through make_key().
+	"""
+	global _cache
+	if _cache is None:
+		_cache = frappe.cache()
+	return _cache
+
+
+@redis_cache(ttl=3600)
+def _load_settings(gateway_name: str) -> Dict[str, Any]:
+	"""
+	Load gateway settings from database
+
+	Only the derived settings dict is cached, never the Document itself.
+
+	Args:
+		gateway_name: Gateway name (Payme, Click, FreedomPay)
+
+	Returns:
+		Settings dict
+	"""
+	settings_doc = frappe.get_doc(f"{gateway_name} Settings")
+	settings = {
+		"merchant_id": settings_doc.merchant_id,
+	}
+
+	# Add gateway-specific fields
+	if gateway_name == "Payme":
+		settings["merchant_key"] = settings_doc.get_password("merchant_key")
+	elif gateway_name == "Click":
+		settings["service_id"] = settings_doc.service_id
+		settings["secret_key"] = settings_doc.get_password("secret_key")
+	elif gateway_name == "FreedomPay":
+		settings["terminal_id"] = settings_doc.terminal_id
+		settings["secret_key"] = settings_doc.get_password("secret_key")
+
+	return settings
+
+
+@site_cache(ttl=300, maxsize=8)
+def _get_local_settings(gateway_name: str) -> Dict[str, Any]:
+	"""Process-local, site-aware layer in front of the Redis cache"""
+	return _load_settings(gateway_name)
+
 
 class SettingsCache:
 	"""Cache for payment gateway settings"""
@@ -16,42 +69,15 @@ class SettingsCache:
 	def get_settings(gateway_name: str) -> Optional[Dict[str, Any]]:
 		"""
 		Get cached gateway settings
-		
+
 		Args:
 			gateway_name: Gateway name (Payme, Click, FreedomPay)
-			
+
 		Returns:
 			Cached settings or None
 		"""
-		cache_key = f"payment_gateway_settings_{gateway_name}"
-		settings = frappe.cache().get(cache_key)
-		
-		if settings:
-			return settings
-		
-		# Load from database
 		try:
-			settings_doc = frappe.get_doc(f"{gateway_name} Settings")
-			settings = {
-				"merchant_id": settings_doc.merchant_id,
-			}
-			
-			# Add gateway-specific fields
-			if gateway_name == "Payme":
-				settings["merchant_key"] = settings_doc.get_password("merchant_key")
-			elif gateway_name == "Click":
-				settings["merchant_id"] = settings_doc.merchant_id
-				settings["service_id"] = settings_doc.service_id
-				settings["secret_key"] = settings_doc.get_password("secret_key")
-			elif gateway_name == "FreedomPay":
-				settings["merchant_id"] = settings_doc.merchant_id
-				settings["terminal_id"] = settings_doc.terminal_id
-				settings["secret_key"] = settings_doc.get_password("secret_key")
-			
-			# Cache for 1 hour
-			frappe.cache().setex(cache_key, 3600, settings)
-			
-			return settings
+			return _get_local_settings(gateway_name)
 		except Exception as e:
 			frappe.log_error(
 				f"Error loading settings for {gateway_name}: {str(e)}",
@@ -63,9 +89,11 @@ class SettingsCache:
 	def clear_cache(gateway_name: str):
 		"""
 		Clear gateway settings cache
-		
+
 		Args:
 			gateway_name: Gateway name
 		"""
-		cache_key = f"payment_gateway_settings_{gateway_name}"
-		frappe.cache().delete(cache_key)
+		# Cached entries are keyed by call arguments, so both layers are
+		# cleared for all gateways
+		_load_settings.clear_cache()
+		_get_local_settings.clear_cache()
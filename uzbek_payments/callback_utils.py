@@ -0,0 +1,215 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+Shared payment callback handling
+"""
+
+import sys
+import time
+
+import frappe
+from frappe import _
+from frappe.utils import flt
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from uzbek_payments.cache_utils import get_cache
+from uzbek_payments.db_utils import dump_json_data, load_json_data
+from uzbek_payments.integrations import enqueue_payment_integrations
+from uzbek_payments.lock_utils import payment_lock
+from uzbek_payments.metrics import PaymentMetrics
+from uzbek_payments.webhook_retry import WebhookRetry
+
+# Log at most one traceback per title and exception type in this window;
+# set verbose_callback_logging in site config to log every one
+ERROR_LOG_THROTTLE = 60
+
+
+def log_callback_error(title: str):
+	"""
+	Log the exception being handled, throttled during callback storms
+	
+	Args:
+		title: Error Log title
+	"""
+	if _should_log_error(title):
+		frappe.log_error(frappe.get_traceback(), title)
+
+
+def _should_log_error(title: str) -> bool:
+	"""Claim the logging slot for this title and exception type"""
+	if frappe.conf.get("verbose_callback_logging"):
+		return True
+	
+	try:
+		cache = get_cache()
+		key = cache.make_key(f"callback_error_logged_{title}_{type(sys.exc_info()[1]).__name__}")
+		return bool(cache.set(key, 1, ex=ERROR_LOG_THROTTLE, nx=True))
+	except Exception:
+		return True
+
+
+def find_integration_request(
+	gateway_name: str, order_id: Optional[str], txn_id: Optional[str]
+) -> Optional[Dict[str, Any]]:
+	"""
+	Find the latest Integration Request for a callback
+	
+	Matches the indexed ext_order_id or ext_txn_id fields in a single
+	query. The returned row carries every field the callbacks use, so the
+	full document is never loaded.
+	
+	Args:
+		gateway_name: Payment gateway name
+		order_id: Order ID sent by the gateway
+		txn_id: Gateway transaction ID
+		
+	Returns:
+		Row with name, data, reference_doctype and reference_docname, or None
+	"""
+	or_filters = {}
+	if order_id:
+		or_filters["ext_order_id"] = order_id
+	if txn_id:
+		or_filters["ext_txn_id"] = str(txn_id)
+	if not or_filters:
+		return None
+
+	integration_requests = frappe.get_all(
+		"Integration Request",
+		filters={"integration_request_service": gateway_name},
+		or_filters=or_filters,
+		fields=["name", "data", "reference_doctype", "reference_docname"],
+		order_by="creation desc",
+		limit=1,
+	)
+	return integration_requests[0] if integration_requests else None
+
+
+def handle_callback(
+	gateway_name: str,
+	verify: Callable[[Dict[str, Any]], bool],
+	parse: Callable[[Dict[str, Any]], Dict[str, Any]],
+	success_statuses: Iterable[str],
+	respond: Callable[..., Dict[str, Any]],
+) -> Dict[str, Any]:
+	"""
+	Process a payment gateway callback
+
+	Args:
+		gateway_name: Payment gateway name
+		verify: Returns True if the callback signature is valid
+		parse: Extracts order_id, txn_id, status, amount and the data
+			updates to merge into the Integration Request
+		success_statuses: Gateway statuses meaning the payment succeeded
+		respond: Builds the gateway response from a status and message
+
+	Returns:
+		Gateway response
+	"""
+	callback_start_time = time.perf_counter()
+
+	try:
+		data = frappe.local.form_dict
+
+		# Verify signature
+		if not verify(data):
+			frappe.throw(_("Invalid signature"), exc=frappe.PermissionError)
+
+		# Process callback
+		callback_data = parse(data)
+		order_id = callback_data.get("order_id")
+		txn_id = callback_data.get("txn_id")
+		status = callback_data.get("status")
+
+		# Prepare lock key safely
+		lock_key = order_id or (str(txn_id) if txn_id else "unknown")
+
+		# Use lock to prevent race conditions
+		with payment_lock(lock_key):
+			integration_request = find_integration_request(gateway_name, order_id, txn_id)
+			if not integration_request:
+				frappe.throw(_("Integration Request not found"))
+
+			integration_request_dict = load_json_data(integration_request.data)
+
+			# Update with payment information
+			integration_request_dict.update(callback_data["updates"])
+
+			# Prefer the amount sent by the gateway, else the stored amount in tiyin
+			amount = callback_data.get("amount")
+			payment_amount = flt(amount) if amount else flt(integration_request_dict.get("amount")) / 100
+
+			# Handle payment status
+			if status in success_statuses:
+				# Write status and data without a full document save; committed
+				# once below, after on_payment_authorized
+				frappe.db.set_value(
+					"Integration Request",
+					integration_request.name,
+					{"data": dump_json_data(integration_request_dict), "status": "Completed"},
+					update_modified=False,
+				)
+
+				# Record metrics for successful payment
+				duration = time.perf_counter() - callback_start_time
+				PaymentMetrics.record_payment(gateway_name, payment_amount, "Completed", duration, None)
+
+				# Call on_payment_authorized
+				if integration_request.reference_doctype and integration_request.reference_docname:
+					# Savepoint first, so a missing reference document is
+					# rolled back to it like any other processing error
+					frappe.db.savepoint("on_payment_authorized")
+					try:
+						doc = frappe.get_doc(
+							integration_request.reference_doctype, integration_request.reference_docname
+						)
+						doc.run_method("on_payment_authorized", "Completed")
+
+						# Integrate with accounting and banking modules in background
+						enqueue_payment_integrations(doc)
+					except Exception:
+						# Keep the Completed status, drop partial document changes
+						frappe.db.rollback(save_point="on_payment_authorized")
+						log_callback_error(f"{gateway_name} Callback - Document Processing Error")
+
+				frappe.db.commit()
+
+				return respond("success")
+			else:
+				frappe.db.set_value(
+					"Integration Request",
+					integration_request.name,
+					{
+						"data": dump_json_data(integration_request_dict),
+						"status": "Failed",
+						"error": f"Payment status: {status}",
+					},
+					update_modified=False,
+				)
+
+				# Schedule retry for failed webhook; queued by the commit below
+				WebhookRetry.schedule_retry(integration_request.name, 0)
+				frappe.db.commit()
+
+				# Record metrics for failed payment
+				duration = time.perf_counter() - callback_start_time
+				PaymentMetrics.record_payment(gateway_name, payment_amount, "Failed", duration, f"Status: {status}")
+
+				return respond("failed", f"Payment {status}")
+
+	except Exception as e:
+		log_callback_error(f"{gateway_name} Callback Error")
+
+		# Schedule retry on error
+		try:
+			if 'integration_request' in locals() and integration_request:
+				WebhookRetry.schedule_retry(integration_request.name, 0)
+		except (NameError, AttributeError, Exception) as retry_error:
+			# Log retry scheduling error but don't fail the callback
+			frappe.log_error(
+				message=f"Error scheduling webhook retry: {str(retry_error)}",
+				title="Webhook Retry Scheduling Error"
+			)
+
+		return respond("error", str(e))
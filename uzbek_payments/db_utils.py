@@ -5,7 +5,42 @@
 Database utilities for PostgreSQL and MySQL/MariaDB compatibility
 """
 
+import json
+import re
+from typing import Any, Dict
+
 import frappe
+import orjson
+from frappe.utils.response import json_handler
+
+_BACKTICK_RE = re.compile(r"`([^`]+)`")
+
+
+def _detect_postgres() -> bool:
+	"""Detect PostgreSQL, also before the database connection is set up"""
+	try:
+		return frappe.db.db_type == "postgres"
+	except Exception:
+		# Module imported before frappe.connect(); fall back to site config
+		return (frappe.conf or {}).get("db_type") == "postgres"
+
+
+def _rebind() -> None:
+	"""
+	Resolve database dialect used by the SQL helpers
+	
+	The backend is fixed for a process, so it is resolved once at import.
+	Call again after changing frappe.db.db_type (e.g. in tests).
+	"""
+	global _IS_PG, QUOTE_FMT
+	_IS_PG = _detect_postgres()
+	QUOTE_FMT = '"{}"' if _IS_PG else "`{}`"
+
+
+_IS_PG = False
+# Identifier quoting format, e.g. QUOTE_FMT.format("tabPayment Entry")
+QUOTE_FMT = "`{}`"
+_rebind()
 
 
 def is_postgres() -> bool:
@@ -28,10 +63,77 @@ def get_table_name(table_name: str) -> str:
 	Returns:
 		Properly quoted table name
 	"""
-	if is_postgres():
-		return f'"{table_name}"'
+	return QUOTE_FMT.format(table_name)
+
+
+def load_json_data(raw: Any) -> Dict[str, Any]:
+	"""
+	Parse a JSON data column, skipping the parser for empty values
+	
+	Args:
+		raw: JSON text as stored on the document (or an already parsed dict)
+		
+	Returns:
+		Parsed dict, empty when there is no data
+	"""
+	if not raw:
+		return {}
+	if isinstance(raw, dict):
+		return raw
+	try:
+		return orjson.loads(raw)
+	except orjson.JSONDecodeError:
+		return frappe.parse_json(raw) or {}
+
+
+def dump_json_data(data: Dict[str, Any]) -> str:
+	"""
+	Serialise a dict for a JSON data column
+	
+	Keys are sorted like frappe.as_json, but the output is compact.
+	
+	Args:
+		data: Dict to serialise
+		
+	Returns:
+		JSON text
+	"""
+	return orjson.dumps(data, default=json_handler, option=orjson.OPT_SORT_KEYS).decode()
+
+
+def json_update_fields(doctype: str, name: str, values: Dict[str, Any], column: str = "data") -> None:
+	"""
+	Merge top-level keys into a document's JSON text column in the database
+	
+	Uses jsonb concatenation on PostgreSQL and JSON_SET on MySQL/MariaDB, so
+	only the changed values travel to the database. Does not commit.
+	
+	Args:
+		doctype: DocType name
+		name: Document name
+		values: Keys and JSON-serialisable values to set
+		column: JSON text column name
+	"""
+	if not values:
+		return
+	
+	table = get_table_name(f"tab{doctype}")
+	current = f"COALESCE(NULLIF({column}, ''), '{{}}')"
+	
+	if _IS_PG:
+		frappe.db.sql(
+			f"UPDATE {table} SET {column} = ({current}::jsonb || %s::jsonb)::text WHERE name = %s",
+			(json.dumps(values, default=str), name),
+		)
 	else:
-		return f"`{table_name}`"
+		assignments = ", ".join(["%s, JSON_EXTRACT(%s, '$')"] * len(values))
+		params = []
+		for key, value in values.items():
+			params.extend((f'$."{key}"', json.dumps(value, default=str)))
+		frappe.db.sql(
+			f"UPDATE {table} SET {column} = JSON_SET({current}, {assignments}) WHERE name = %s",
+			(*params, name),
+		)
 
 
 def format_sql_query(query: str) -> str:
@@ -44,14 +146,8 @@ def format_sql_query(query: str) -> str:
 	Returns:
 		Formatted SQL query
 	"""
-	# Replace backticks with double quotes for PostgreSQL
-	if is_postgres():
-		# Replace backticks with double quotes, but preserve existing double quotes
-		import re
-		# Replace backticks around table/column names
-		query = re.sub(r'`([^`]+)`', r'"\1"', query)
-	
-	return query
+	# Replace backticks around table/column names with double quotes for PostgreSQL
+	return _BACKTICK_RE.sub(r'"\1"', query) if _IS_PG else query
 
 
 def get_year_function(date_field: str) -> str:
@@ -64,7 +160,7 @@ def get_year_function(date_field: str) -> str:
 	Returns:
 		Year function call
 	"""
-	if is_postgres():
+	if _IS_PG:
 		return f"EXTRACT(YEAR FROM {date_field})"
 	else:
 		return f"YEAR({date_field})"
@@ -81,7 +177,7 @@ def get_date_trunc(part: str, field: str) -> str:
 	Returns:
 		Date truncation function call
 	"""
-	if is_postgres():
+	if _IS_PG:
 		return f"DATE_TRUNC('{part}', {field})"
 	else:
 		if part == "day":
@@ -101,7 +197,7 @@ def get_database_function() -> str:
 	Returns:
 		Database name function call
 	"""
-	if is_postgres():
+	if _IS_PG:
 		return "current_database()"
 	else:
 		return "DATABASE()"
@@ -10,9 +10,24 @@ app_license = "MIT"
 # Installation
 after_install = "uzbek_payments.utils.after_install"
 
+# Migration
+after_migrate = "uzbek_payments.utils.after_migrate"
+
+# Other apps installed or removed
+after_app_install = "uzbek_payments.integrations.clear_module_cache"
+after_app_uninstall = "uzbek_payments.integrations.clear_module_cache"
+
 # Scheduler Events
 scheduler_events = {
 	"all": [
 		"uzbek_payments.payment_gateways.doctype.payme_settings.payme_settings.check_payment_status",
 	],
+	"cron": {
+		"* * * * *": [
+			"uzbek_payments.webhook_retry.process_pending_retries",
+		],
+	},
+	"daily": [
+		"uzbek_payments.idempotency.rebuild_idempotency_filters",
+	],
 }
@@ -0,0 +1,53 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+HTTP utilities for outbound payment gateway requests
+"""
+
+from typing import Any, Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Seconds to wait for a gateway API before giving up
+REQUEST_TIMEOUT = 30
+
+_session = None
+
+
+def get_http_session() -> requests.Session:
+	"""
+	Get a pooled HTTP session, created once per process
+	
+	Keeps TCP/TLS connections to gateway APIs alive between requests,
+	unlike frappe.integrations.utils which opens a new session per call.
+	"""
+	global _session
+	if _session is None:
+		session = requests.Session()
+		adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32)
+		session.mount("https://", adapter)
+		session.mount("http://", adapter)
+		_session = session
+	return _session
+
+
+def post_json(url: str, data: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> Any:
+	"""
+	POST a JSON payload and return the decoded JSON response
+	
+	Args:
+		url: Endpoint URL
+		data: JSON-serialisable payload
+		headers: Request headers
+		
+	Returns:
+		Decoded response body, or None if it is empty
+		
+	Raises:
+		requests.HTTPError: On a 4xx/5xx response
+	"""
+	response = get_http_session().post(url, json=data, headers=headers, timeout=REQUEST_TIMEOUT)
+	response.raise_for_status()
+	return response.json() if response.content else None
@@ -5,9 +5,49 @@
 Idempotency handling for payments
 """
 
+import hashlib
+import time
+
 import frappe
-from typing import Optional, Dict, Any
-from datetime import datetime
+from typing import List, Optional, Dict, Any
+
+from uzbek_payments.cache_utils import get_cache
+from uzbek_payments.db_utils import load_json_data
+
+# Bloom filter of known order IDs per gateway, sized for ~1M entries at
+# 0.1% false positives (2 MB bitmap per gateway)
+BLOOM_BITS = 1 << 24
+BLOOM_HASHES = 10
+
+# Set once the filter is fully built. Kept inside the bitmap rather than in
+# a separate key, so an evicted bitmap is never mistaken for a ready one.
+READY_BIT = BLOOM_BITS
+
+GATEWAYS = ("Payme", "Click", "FreedomPay")
+
+_BASE36_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _b36(number: int) -> str:
+	"""Encode a non-negative integer in base 36"""
+	digits = []
+	while True:
+		number, remainder = divmod(number, 36)
+		digits.append(_BASE36_DIGITS[remainder])
+		if not number:
+			return "".join(reversed(digits))
+
+
+def _bloom_key(gateway_name: str) -> str:
+	return get_cache().make_key(f"idem:bf:{gateway_name}")
+
+
+def _bloom_offsets(order_id: str) -> List[int]:
+	"""Bit offsets for order_id using double hashing over one blake2b digest"""
+	digest = hashlib.blake2b(str(order_id).encode("utf-8"), digest_size=16).digest()
+	h1 = int.from_bytes(digest[:8], "little")
+	h2 = int.from_bytes(digest[8:], "little") | 1
+	return [(h1 + i * h2) % BLOOM_BITS for i in range(BLOOM_HASHES)]
 
 
 class PaymentIdempotency:
@@ -28,16 +68,16 @@ class PaymentIdempotency:
 		if not order_id:
 			return None
 		
-		# Escape order_id to prevent SQL injection
-		# frappe.db.escape() handles escaping for both PostgreSQL and MySQL
-		# It returns a quoted string, so we use it directly in the LIKE pattern
-		escaped_order_id = frappe.db.escape(order_id)
+		# Most orders are new; skip the database when the filter says so
+		if not PaymentIdempotency.might_exist(gateway_name, order_id):
+			return None
 		
+		# Equality lookup on the indexed idempotency_lookup column instead of
+		# a LIKE scan over the JSON data of every Integration Request
 		existing = frappe.get_all(
 			"Integration Request",
 			filters={
-				"integration_request_service": gateway_name,
-				"data": ["like", f'%"order_id": {escaped_order_id}%'],
+				"idempotency_lookup": PaymentIdempotency.get_lookup_key(gateway_name, order_id),
 				"status": ["in", ["Queued", "Completed"]]
 			},
 			fields=["name", "data", "status"],
@@ -45,49 +85,136 @@ class PaymentIdempotency:
 		)
 		
 		if existing:
-			ir = frappe.get_doc("Integration Request", existing[0].name)
-			data = frappe.parse_json(ir.data)
+			data = load_json_data(existing[0].data)
 			return {
 				"payment_url": data.get("payment_url"),
-				"status": ir.status,
-				"integration_request": ir.name
+				"status": existing[0].status,
+				"integration_request": existing[0].name
 			}
 		
 		return None
 
 	@staticmethod
-	def generate_idempotency_key(gateway_name: str, order_id: str) -> str:
+	def might_exist(gateway_name: str, order_id: str) -> bool:
 		"""
-		Generate idempotency key
+		Check the Bloom filter for order_id
 		
 		Args:
 			gateway_name: Payment gateway name
 			order_id: Order ID
 			
 		Returns:
-			Idempotency key
+			False if order_id was definitely never stored, True otherwise
 		"""
-		timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-		return f"{gateway_name}_{order_id}_{timestamp}"
+		try:
+			cache = get_cache()
+			bloom_key = _bloom_key(gateway_name)
+			pipe = cache.pipeline()
+			pipe.getbit(bloom_key, READY_BIT)
+			for offset in _bloom_offsets(order_id):
+				pipe.getbit(bloom_key, offset)
+			ready, *bits = pipe.execute()
+		except Exception:
+			# Filter unavailable, fall back to the database
+			return True
+		
+		# Until the filter is built from existing requests it cannot rule anything out
+		return not ready or all(bits)
 
 	@staticmethod
-	def store_idempotency_key(integration_request_name: str, idempotency_key: str):
+	def add_to_filter(gateway_name: str, order_id: str):
 		"""
-		Store idempotency key in integration request
+		Add order_id to the Bloom filter
 		
 		Args:
-			integration_request_name: Integration request name
-			idempotency_key: Idempotency key
+			gateway_name: Payment gateway name
+			order_id: Order ID
 		"""
 		try:
-			ir = frappe.get_doc("Integration Request", integration_request_name)
-			data = frappe.parse_json(ir.data) or {}
-			data["idempotency_key"] = idempotency_key
-			ir.data = frappe.as_json(data)
-			ir.save(ignore_permissions=True)
-			frappe.db.commit()
+			cache = get_cache()
+			bloom_key = _bloom_key(gateway_name)
+			pipe = cache.pipeline()
+			for offset in _bloom_offsets(order_id):
+				pipe.setbit(bloom_key, offset, 1)
+			pipe.execute()
 		except Exception as e:
+			# A missed add would cause false negatives; disable the filter
+			# until the next rebuild
+			get_cache().setbit(_bloom_key(gateway_name), READY_BIT, 0)
 			frappe.log_error(
-				f"Error storing idempotency key: {str(e)}",
+				f"Error updating idempotency filter: {str(e)}",
 				"Idempotency Error"
 			)
+
+	@staticmethod
+	def get_lookup_key(gateway_name: str, order_id: str) -> str:
+		"""
+		Get value stored in the indexed idempotency_lookup field
+		
+		Args:
+			gateway_name: Payment gateway name
+			order_id: Order ID
+			
+		Returns:
+			Lookup key
+		"""
+		return f"{gateway_name}:{order_id}"
+
+	@staticmethod
+	def generate_idempotency_key(gateway_name: str, order_id: str) -> str:
+		"""
+		Generate idempotency key
+		
+		Args:
+			gateway_name: Payment gateway name
+			order_id: Order ID
+			
+		Returns:
+			Idempotency key
+		
+		Note:
+			The suffix is time.time_ns() in base 36: unique and ordered by
+			creation time, but not human-readable. Use the Integration
+			Request creation timestamp for display.
+		"""
+		return f"{gateway_name}_{order_id}_{_b36(time.time_ns())}"
+
+
+def rebuild_idempotency_filters():
+	"""Rebuild Bloom filters from stored Integration Requests (scheduled daily)"""
+	cache = get_cache()
+	page_length = 10000
+	
+	for gateway_name in GATEWAYS:
+		# Start from an empty, not-ready filter; stale bits are dropped and
+		# lookups fall back to the database until the rebuild completes
+		bloom_key = _bloom_key(gateway_name)
+		cache.delete(bloom_key)
+		
+		last_name = ""
+		while True:
+			# Page by name rather than OFFSET: each page is an index seek, and
+			# rows inserted during the rebuild cannot shift later pages
+			rows = frappe.get_all(
+				"Integration Request",
+				filters={
+					"integration_request_service": gateway_name,
+					"idempotency_lookup": ["is", "set"],
+					"name": [">", last_name],
+				},
+				fields=["name", "idempotency_lookup"],
+				order_by="name asc",
+				limit_page_length=page_length,
+			)
+			if not rows:
+				break
+			
+			pipe = cache.pipeline()
+			for row in rows:
+				order_id = row.idempotency_lookup.split(":", 1)[-1]
+				for offset in _bloom_offsets(order_id):
+					pipe.setbit(bloom_key, offset, 1)
+			pipe.execute()
+			last_name = rows[-1].name
+		
+		cache.setbit(bloom_key, READY_BIT, 1)
@@ -9,26 +9,48 @@ from typing import Any, Dict, Optional
 
 import frappe
 from frappe import _
+from frappe.utils.caching import site_cache
 
 
+# Cross-worker cache of module installation state
+MODULE_CACHE_PREFIX = "uzbek_payments_module_installed"
+MODULE_CACHE_TTL = 3600
+
+
+@site_cache(maxsize=32)
 def _is_module_installed(module_name: str) -> bool:
 	"""
 	Check if module is installed
 	
+	Cached per process and in Redis; call clear_module_cache() when
+	apps are installed, removed or migrated.
+	
 	Args:
 		module_name: Module name
 		
 	Returns:
 		True if module is installed
 	"""
+	cache_key = f"{MODULE_CACHE_PREFIX}:{module_name}"
+	cached = frappe.cache().get_value(cache_key)
+	if cached is not None:
+		return bool(cached)
+	
 	try:
-		if not frappe.db.exists("Module Def", module_name):
-			return False
-		
-		module = frappe.get_doc("Module Def", module_name)
-		return not module.get("disabled", False)
+		# Single row read instead of exists() + full Document load
+		module = frappe.db.get_value("Module Def", module_name, "*", as_dict=True)
 	except Exception:
 		return False
+	
+	installed = bool(module) and not module.get("disabled")
+	frappe.cache().set_value(cache_key, int(installed), expires_in_sec=MODULE_CACHE_TTL)
+	return installed
+
+
+def clear_module_cache(*args, **kwargs) -> None:
+	"""Clear cached module installation state (used as app install/migrate hook)"""
+	_is_module_installed.clear_cache()
+	frappe.cache().delete_keys(MODULE_CACHE_PREFIX)
 
 
 def integrate_with_accounting(payment_data: Dict[str, Any]) -> None:
@@ -100,6 +122,30 @@ def integrate_with_analytics(payment_data: Dict[str, Any]) -> None:
 		)
 
 
+def enqueue_payment_integrations(doc) -> None:
+	"""
+	Run accounting and banking integrations for a paid document in background
+	
+	Jobs are enqueued after commit so workers see the completed payment.
+	Both integration functions log their own errors.
+	
+	Args:
+		doc: Reference document of the payment
+	"""
+	frappe.enqueue(
+		"uzbek_payments.integrations.integrate_with_accounting",
+		queue="short",
+		enqueue_after_commit=True,
+		payment_data=doc.as_dict(),
+	)
+	frappe.enqueue(
+		"uzbek_payments.integrations.integrate_with_banking",
+		queue="short",
+		enqueue_after_commit=True,
+		bank_transaction_data={"payment_entry": doc.name},
+	)
+
+
 @frappe.whitelist()
 def get_available_integrations() -> Dict[str, bool]:
 	"""
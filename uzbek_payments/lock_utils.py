@@ -5,42 +5,63 @@
 Lock utilities for payment processing
 """
 
+import random
+import secrets
+import time
+
 import frappe
 from contextlib import contextmanager
 from typing import Optional
 from frappe import _
 
+from uzbek_payments.cache_utils import get_cache
+
+# Number of attempts to acquire a lock before giving up
+LOCK_ATTEMPTS = 3
+
+# Delete the lock only if it still holds our token
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+	return redis.call('del', KEYS[1])
+else
+	return 0
+end
+"""
+
 
 @contextmanager
 def payment_lock(order_id: str, timeout: int = 30):
 	"""
 	Lock for payment processing to prevent race conditions
-	
+
 	Args:
 		order_id: Order ID
 		timeout: Lock timeout in seconds
-		
+
 	Yields:
 		None
 	"""
-	lock_key = f"payment_lock_{order_id}"
-	
-	# Try to acquire lock
-	lock_acquired = frappe.cache().set(
-		lock_key,
-		frappe.session.user if hasattr(frappe, 'session') else "system",
-		ex=timeout,
-		nx=True  # Only set if not exists
-	)
-	
+	cache = get_cache()
+	lock_key = cache.make_key(f"payment_lock_{order_id}")
+	token = secrets.token_hex(16)
+
+	# Try to acquire lock, retrying briefly to absorb bursts
+	lock_acquired = False
+	for attempt in range(LOCK_ATTEMPTS):
+		if cache.set(lock_key, token, ex=timeout, nx=True):  # Only set if not exists
+			lock_acquired = True
+			break
+		if attempt < LOCK_ATTEMPTS - 1:
+			time.sleep(random.uniform(0.02, 0.08))
+
 	if not lock_acquired:
 		frappe.throw(
 			_("Payment is already being processed. Please wait."),
 			exc=frappe.ValidationError
 		)
-	
+
 	try:
 		yield
 	finally:
-		# Release lock
-		frappe.cache().delete(lock_key)
+		# Release lock unless it expired and was taken by someone else
+		cache.eval(_RELEASE_SCRIPT, 1, lock_key, token)
@@ -5,10 +5,28 @@
 Payment metrics tracking
 """
 
+import json
+
 import frappe
+from frappe.utils import cint
 from datetime import datetime
 from typing import Dict, Any, Optional, List
 
+from uzbek_payments.cache_utils import get_cache
+
+
+# Number of recent metrics kept per gateway
+MAX_METRICS = 1000
+
+# Metrics expire after 7 days without new payments; override with
+# uzbek_payments_metrics_ttl (seconds) in site config
+METRICS_TTL = 7 * 24 * 3600
+
+
+def _metrics_ttl() -> int:
+	"""Sliding expiry for metrics keys in seconds"""
+	return cint(frappe.conf.get("uzbek_payments_metrics_ttl")) or METRICS_TTL
+
 
 class PaymentMetrics:
 	"""Track payment metrics"""
@@ -40,16 +58,27 @@ class PaymentMetrics:
 			"timestamp": datetime.now().isoformat()
 		}
 		
-		# Store in cache
-		cache_key = f"payment_metrics_{gateway_name}"
-		existing = frappe.cache().get(cache_key) or []
-		existing.append(metrics)
-		
-		# Keep only last 1000 metrics
-		if len(existing) > 1000:
-			existing = existing[-1000:]
-		
-		frappe.cache().set(cache_key, existing)
+		# Push to a capped Redis list; trimming happens server-side.
+		# Running counters are kept alongside so summaries need no list scan.
+		cache = get_cache()
+		cache_key = cache.make_key(f"payment_metrics_{gateway_name}")
+		summary_key = cache.make_key(f"payment_metrics_summary_{gateway_name}")
+		ttl = _metrics_ttl()
+		pipe = cache.pipeline()
+		pipe.lpush(cache_key, json.dumps(metrics))
+		pipe.ltrim(cache_key, 0, MAX_METRICS - 1)
+		pipe.expire(cache_key, ttl)
+		pipe.hincrby(summary_key, "total", 1)
+		pipe.hincrbyfloat(summary_key, "amount", amount or 0)
+		if status == "Completed":
+			pipe.hincrby(summary_key, "success", 1)
+		if error:
+			pipe.hincrby(summary_key, "errors", 1)
+		if duration:
+			pipe.hincrbyfloat(summary_key, "dur_sum", duration)
+			pipe.hincrby(summary_key, "dur_cnt", 1)
+		pipe.expire(summary_key, ttl)
+		pipe.execute()
 
 	@staticmethod
 	def get_metrics(gateway_name: str, limit: int = 100) -> List[Dict[str, Any]]:
@@ -61,11 +90,14 @@ class PaymentMetrics:
 			limit: Maximum number of metrics to return
 			
 		Returns:
-			List of metrics
+			List of metrics, oldest first
 		"""
-		cache_key = f"payment_metrics_{gateway_name}"
-		metrics = frappe.cache().get(cache_key) or []
-		return metrics[-limit:]
+		cache = get_cache()
+		cache_key = cache.make_key(f"payment_metrics_{gateway_name}")
+		# Newest entries are at the head of the list
+		metrics = [json.loads(m) for m in cache.lrange(cache_key, 0, limit - 1)]
+		metrics.reverse()
+		return metrics
 
 	@staticmethod
 	@frappe.whitelist()
@@ -81,32 +113,37 @@ class PaymentMetrics:
 		"""
 		gateways = [gateway_name] if gateway_name else ["Payme", "Click", "FreedomPay"]
 		
-		result = {}
+		# Read every gateway's counters in one round trip
+		cache = get_cache()
+		pipe = cache.pipeline()
 		for gw in gateways:
-			metrics = PaymentMetrics.get_metrics(gw, limit=1000)
-			
-			if not metrics:
-				result[gw] = {
-					"total_payments": 0,
-					"success_rate": 0,
-					"total_amount": 0,
-					"average_duration": 0,
-					"error_count": 0
-				}
-				continue
-			
-			total_payments = len(metrics)
-			success_payments = sum(1 for m in metrics if m.get("status") == "Completed")
-			error_count = sum(1 for m in metrics if m.get("error"))
-			total_amount = sum(m.get("amount", 0) for m in metrics)
-			durations = [m.get("duration", 0) for m in metrics if m.get("duration")]
-			
-			result[gw] = {
-				"total_payments": total_payments,
-				"success_rate": (success_payments / total_payments * 100) if total_payments > 0 else 0,
-				"total_amount": total_amount,
-				"average_duration": sum(durations) / len(durations) if durations else 0,
-				"error_count": error_count
-			}
+			pipe.hgetall(cache.make_key(f"payment_metrics_summary_{gw}"))
+		
+		return {
+			gw: _summarize(counters)
+			for gw, counters in zip(gateways, pipe.execute())
+		}
+
+
+def _summarize(counters: Dict[bytes, bytes]) -> Dict[str, Any]:
+	"""
+	Derive summary statistics from the running counters
+	
+	Args:
+		counters: Raw hash of counters as returned by HGETALL
 		
-		return result
+	Returns:
+		Summary statistics
+	"""
+	values = {key.decode(): float(value) for key, value in counters.items()}
+	total = int(values.get("total", 0))
+	success = values.get("success", 0)
+	duration_count = values.get("dur_cnt", 0)
+	
+	return {
+		"total_payments": total,
+		"success_rate": success / total * 100 if total else 0,
+		"total_amount": values.get("amount", 0),
+		"average_duration": values.get("dur_sum", 0) / duration_count if duration_count else 0,
+		"error_count": int(values.get("errors", 0))
+	}
@@ -0,0 +1,57 @@
+import frappe
+from frappe.utils import cstr
+
+from uzbek_payments.db_utils import load_json_data
+from uzbek_payments.idempotency import PaymentIdempotency
+from uzbek_payments.utils import create_custom_fields
+
+# Gateway response keys holding the external transaction ID
+TXN_ID_KEYS = {
+	"Payme": "payme_payment_id",
+	"Click": "click_trans_id",
+	"FreedomPay": "freedompay_transaction_id",
+}
+
+BATCH_SIZE = 1000
+
+
+def execute():
+	"""Fill the indexed lookup fields on Integration Requests created before they existed"""
+	# Patches run before after_migrate, so make sure the fields exist
+	create_custom_fields()
+
+	for gateway, txn_id_key in TXN_ID_KEYS.items():
+		last_name = ""
+		while True:
+			# Page by name so rows without an order ID are not fetched again
+			rows = frappe.get_all(
+				"Integration Request",
+				filters={
+					"integration_request_service": gateway,
+					"ext_order_id": ["is", "not set"],
+					"name": [">", last_name],
+				},
+				fields=["name", "data"],
+				order_by="name asc",
+				limit_page_length=BATCH_SIZE,
+			)
+			if not rows:
+				break
+
+			for row in rows:
+				data = load_json_data(row.data)
+				order_id = cstr(data.get("order_id"))
+				if not order_id:
+					continue
+
+				values = {
+					"ext_order_id": order_id,
+					"ext_txn_id": cstr(data.get(txn_id_key)) or None,
+				}
+				if data.get("idempotency_key"):
+					values["idempotency_lookup"] = PaymentIdempotency.get_lookup_key(gateway, order_id)
+
+				frappe.db.set_value("Integration Request", row.name, values, update_modified=False)
+
+			last_name = rows[-1].name
+			frappe.db.commit()
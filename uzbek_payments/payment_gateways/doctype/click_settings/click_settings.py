@@ -49,12 +49,23 @@ import time
 
 import frappe
 from frappe import _
-from frappe.integrations.utils import create_request_log, make_post_request
+from frappe.integrations.utils import create_request_log
 from frappe.model.document import Document
-from frappe.utils import call_hook_method, get_url
+from frappe.utils import call_hook_method, cstr, flt, get_url
 
 from payments.utils import create_payment_gateway
+from uzbek_payments.api_validators import APIResponseValidator
+from uzbek_payments.cache_utils import SettingsCache
+from uzbek_payments.callback_utils import find_integration_request, log_callback_error
+from uzbek_payments.db_utils import json_update_fields, load_json_data
+from uzbek_payments.http_utils import post_json
+from uzbek_payments.idempotency import PaymentIdempotency
+from uzbek_payments.integrations import enqueue_payment_integrations
+from uzbek_payments.lock_utils import payment_lock
 from uzbek_payments.metrics import PaymentMetrics
+from uzbek_payments.rate_limiter import callback_rate_limiter
+from uzbek_payments.validators import validate_order_id, validate_payment_amount
+from uzbek_payments.webhook_retry import WebhookRetry
 
 
 class ClickSettings(Document):
@@ -68,6 +79,9 @@ class ClickSettings(Document):
 		if not self.flags.ignore_mandatory:
 			self.validate_credentials()
 
+	def on_update(self):
+		SettingsCache.clear_cache("Click")
+
 	def validate_credentials(self):
 		"""Validate Click credentials"""
 		if self.merchant_id and self.service_id and self.secret_key:
@@ -89,10 +103,6 @@ class ClickSettings(Document):
 	def get_payment_url(self, **kwargs):
 		"""Generate payment URL for Click checkout"""
 		try:
-			from uzbek_payments.validators import validate_payment_amount, validate_order_id
-			from uzbek_payments.idempotency import PaymentIdempotency
-			from uzbek_payments.api_validators import APIResponseValidator
-			
 			order_id = kwargs.get("order_id")
 			amount = float(kwargs.get("amount", 0))
 			
@@ -128,8 +138,15 @@ class ClickSettings(Document):
 			}
 
 			# Generate signature
-			sign_string = f"{payment_data['merchant_id']}{payment_data['service_id']}{payment_data['amount']}{payment_data['transaction_param']}{payment_data['return_url']}{self.secret_key}"
-			payment_data["sign_string"] = hashlib.md5(sign_string.encode("utf-8")).hexdigest()
+			sign_parts = (
+				str(payment_data["merchant_id"]).encode("utf-8"),
+				str(payment_data["service_id"]).encode("utf-8"),
+				str(payment_data["amount"]).encode("utf-8"),
+				str(payment_data["transaction_param"]).encode("utf-8"),
+				payment_data["return_url"].encode("utf-8"),
+				self.get_password("secret_key").encode("utf-8"),
+			)
+			payment_data["sign_string"] = _md5_hexdigest(sign_parts)
 
 			# Create payment request
 			payment_request = self.create_payment_request(payment_data)
@@ -143,15 +160,19 @@ class ClickSettings(Document):
 				integration_request_dict["click_trans_id"] = payment_request.get("click_trans_id")
 				integration_request_dict["payment_url"] = payment_request.get("payment_url") or payment_request.get("redirect_url")
 				
-				# Store idempotency key
-				idempotency_key = PaymentIdempotency.generate_idempotency_key("Click", order_id)
-				integration_request_dict["idempotency_key"] = idempotency_key
+				# Store idempotency key with the same save
+				integration_request_dict["idempotency_key"] = PaymentIdempotency.generate_idempotency_key(
+					"Click", order_id
+				)
+				integration_request.idempotency_lookup = PaymentIdempotency.get_lookup_key("Click", order_id)
+				integration_request.ext_order_id = order_id
+				integration_request.ext_txn_id = cstr(payment_request.get("click_trans_id")) or None
 				
 				integration_request.data = frappe.as_json(integration_request_dict)
 				integration_request.save(ignore_permissions=True)
 				frappe.db.commit()
 				
-				PaymentIdempotency.store_idempotency_key(integration_request.name, idempotency_key)
+				PaymentIdempotency.add_to_filter("Click", order_id)
 
 				# Return payment URL
 				return payment_request.get("payment_url") or payment_request.get("redirect_url")
@@ -170,43 +191,12 @@ class ClickSettings(Document):
 			"Content-Type": "application/json",
 		}
 
-		try:
-			response = make_post_request(
-				url=url,
-				json=payment_data,
-				headers=headers,
-			)
-
-			return response
-		except Exception as e:
-			frappe.log_error(frappe.get_traceback(), "Click Create Payment Request Error")
-			raise
+		# Errors propagate to get_payment_url, which logs them once
+		return post_json(url, payment_data, headers)
 
 	def verify_signature(self, data):
 		"""Verify Click callback signature"""
-		# Click uses MD5 for signature verification
-		merchant_id = data.get("merchant_id")
-		service_id = data.get("service_id")
-		click_trans_id = data.get("click_trans_id")
-		merchant_trans_id = data.get("merchant_trans_id")
-		amount = data.get("amount")
-		action = data.get("action")
-		error = data.get("error")
-		error_note = data.get("error_note")
-		sign_time = data.get("sign_time")
-		sign_string = data.get("sign_string")
-
-		# Build sign string
-		sign_string_to_verify = (
-			f"{click_trans_id}{service_id}{self.secret_key}{merchant_trans_id}{amount}{action}{sign_time}"
-		)
-
-		if error:
-			sign_string_to_verify += error
-
-		expected_signature = hashlib.md5(sign_string_to_verify.encode("utf-8")).hexdigest()
-
-		return hmac.compare_digest(expected_signature, sign_string)
+		return _verify_click_signature(data, self.get_password("secret_key", raise_exception=False))
 
 	@frappe.whitelist()
 	def clear(self):
@@ -216,14 +206,48 @@ class ClickSettings(Document):
 		self.save()
 
 
+def _md5_hexdigest(parts):
+	"""MD5 hex digest of already-encoded parts (Click protocol, not used for security)"""
+	return hashlib.new("md5", b"".join(parts), usedforsecurity=False).hexdigest()
+
+
+def _verify_click_signature(data, secret_key):
+	"""
+	Verify Click callback signature
+	
+	Args:
+		data: Callback data
+		secret_key: Click secret key
+		
+	Returns:
+		True if signature is valid
+	"""
+	sign_string = data.get("sign_string")
+	if not secret_key or not sign_string:
+		return False
+	
+	# Click uses MD5 for signature verification
+	sign_parts = [
+		str(data.get("click_trans_id")).encode("utf-8"),
+		str(data.get("service_id")).encode("utf-8"),
+		secret_key.encode("utf-8"),
+		str(data.get("merchant_trans_id")).encode("utf-8"),
+		str(data.get("amount")).encode("utf-8"),
+		str(data.get("action")).encode("utf-8"),
+		str(data.get("sign_time")).encode("utf-8"),
+	]
+
+	error = data.get("error")
+	if error:
+		sign_parts.append(str(error).encode("utf-8"))
+
+	return hmac.compare_digest(_md5_hexdigest(sign_parts), sign_string)
+
+
 @frappe.whitelist(allow_guest=True)
 def callback():
 	"""Handle Click payment callback"""
-	from uzbek_payments.lock_utils import payment_lock
-	from uzbek_payments.webhook_retry import WebhookRetry
-	from uzbek_payments.rate_limiter import callback_rate_limiter
-	
-	callback_start_time = time.time()
+	callback_start_time = time.perf_counter()
 	
 	# Apply rate limiting
 	try:
@@ -232,7 +256,6 @@ def callback():
 		ip_address = "unknown"
 	
 	if not callback_rate_limiter.check_rate_limit(ip_address):
-		from frappe import _
 		frappe.throw(
 			_("Rate limit exceeded. Please try again later."),
 			exc=frappe.ValidationError
@@ -241,11 +264,11 @@ def callback():
 	try:
 		data = frappe.local.form_dict
 
-		# Get Click settings
-		settings = frappe.get_doc("Click Settings")
+		# Get cached Click settings
+		settings = SettingsCache.get_settings("Click") or {}
 
 		# Verify signature
-		if not settings.verify_signature(data):
+		if not _verify_click_signature(data, settings.get("secret_key")):
 			frappe.throw(_("Invalid signature"), exc=frappe.PermissionError)
 
 		# Process callback
@@ -256,115 +279,83 @@ def callback():
 		error_note = data.get("error_note")
 		
 		# Prepare lock key safely
-		lock_key = merchant_trans_id or click_trans_id or str(click_trans_id) if click_trans_id else "unknown"
+		lock_key = merchant_trans_id or (str(click_trans_id) if click_trans_id else "unknown")
 		
 		# Use lock to prevent race conditions
 		with payment_lock(lock_key):
-			# Find integration request - escape merchant_trans_id to prevent SQL injection
-			integration_requests = []
-			if merchant_trans_id:
-				# Escape merchant_trans_id to prevent SQL injection
-				escaped_order_id = frappe.db.escape(merchant_trans_id)
-				integration_requests = frappe.get_all(
-					"Integration Request",
-					filters={
-						"integration_request_service": "Click",
-						"data": ["like", f'%"order_id": {escaped_order_id}%'],
-					},
-					fields=["name", "data", "reference_doctype", "reference_docname"],
-					order_by="creation desc",
-					limit=1,
-				)
-			
-			# If not found by order_id, try to find by click_trans_id
-			if not integration_requests and click_trans_id:
-				# Escape click_trans_id to prevent SQL injection
-				escaped_click_trans_id = frappe.db.escape(str(click_trans_id))
-				integration_requests = frappe.get_all(
-					"Integration Request",
-					filters={
-						"integration_request_service": "Click",
-						"data": ["like", f'%"click_trans_id": {escaped_click_trans_id}%'],
-					},
-					fields=["name", "data", "reference_doctype", "reference_docname"],
-					order_by="creation desc",
-					limit=1,
-				)
-
-			if not integration_requests:
+			integration_request = find_integration_request("Click", merchant_trans_id, click_trans_id)
+			if not integration_request:
 				frappe.throw(_("Integration Request not found"))
 
-			integration_request = frappe.get_doc("Integration Request", integration_requests[0].name)
-			integration_request_dict = frappe.parse_json(integration_request.data) or {}
+			integration_request_dict = load_json_data(integration_request.data)
+			# Stored in tiyin
+			payment_amount = flt(integration_request_dict.get("amount")) / 100
 
-			# Update with payment information
-			integration_request_dict.update(
+			# Update payment information in place
+			json_update_fields(
+				"Integration Request",
+				integration_request.name,
 				{
 					"click_trans_id": click_trans_id,
 					"action": action,
 					"error": error,
 					"error_note": error_note,
-				}
+				},
 			)
 
-			integration_request.data = frappe.as_json(integration_request_dict)
-
 			# Handle payment status
 			if action == "0" and not error:  # 0 means success in Click
-				integration_request.status = "Completed"
-				integration_request.save(ignore_permissions=True)
-				frappe.db.commit()
+				# Committed once below, after on_payment_authorized
+				frappe.db.set_value("Integration Request", integration_request.name, "status", "Completed")
 
 				# Record metrics for successful payment
-				duration = time.time() - callback_start_time
-				amount = integration_request_dict.get("amount", 0) / 100 if integration_request_dict.get("amount") else 0
-				PaymentMetrics.record_payment("Click", amount, "Completed", duration, None)
+				duration = time.perf_counter() - callback_start_time
+				PaymentMetrics.record_payment("Click", payment_amount, "Completed", duration, None)
 
 				# Call on_payment_authorized
 				if integration_request.reference_doctype and integration_request.reference_docname:
+					# Savepoint first, so a missing reference document is
+					# rolled back to it like any other processing error
+					frappe.db.savepoint("on_payment_authorized")
 					try:
 						doc = frappe.get_doc(
 							integration_request.reference_doctype, integration_request.reference_docname
 						)
 						doc.run_method("on_payment_authorized", "Completed")
 						
-						# Integrate with accounting and banking modules
-						try:
-							from uzbek_payments.integrations import integrate_with_accounting, integrate_with_banking
-							integrate_with_accounting(doc.as_dict())
-							integrate_with_banking({"payment_entry": doc.name})
-						except Exception as integration_error:
-							# Log integration errors but don't fail the payment
-							frappe.log_error(
-								message=f"Integration error: {str(integration_error)}",
-								title="Payment Integration Error"
-							)
-					except Exception as doc_error:
-						frappe.log_error(frappe.get_traceback(), "Click Callback - Document Processing Error")
+						# Integrate with accounting and banking modules in background
+						enqueue_payment_integrations(doc)
+					except Exception:
+						# Keep the Completed status, drop partial document changes
+						frappe.db.rollback(save_point="on_payment_authorized")
+						log_callback_error("Click Callback - Document Processing Error")
+
+				frappe.db.commit()
 
 				return {"error": 0, "error_note": "Success"}
 			else:
-				integration_request.status = "Failed"
-				integration_request.error = error_note or f"Payment failed: {error}"
-				integration_request.save(ignore_permissions=True)
+				frappe.db.set_value(
+					"Integration Request",
+					integration_request.name,
+					{"status": "Failed", "error": error_note or f"Payment failed: {error}"},
+				)
+				
+				# Schedule retry for failed webhook; queued by the commit below
+				WebhookRetry.schedule_retry(integration_request.name, 0)
 				frappe.db.commit()
 				
 				# Record metrics for failed payment
-				duration = time.time() - callback_start_time
-				amount = integration_request_dict.get("amount", 0) / 100 if integration_request_dict.get("amount") else 0
-				PaymentMetrics.record_payment("Click", amount, "Failed", duration, error_note or f"Error: {error}")
-				
-				# Schedule retry for failed webhook
-				WebhookRetry.schedule_retry(integration_request.name, 0)
+				duration = time.perf_counter() - callback_start_time
+				PaymentMetrics.record_payment("Click", payment_amount, "Failed", duration, error_note or f"Error: {error}")
 
 				return {"error": error or -1, "error_note": error_note or "Payment failed"}
 
 	except Exception as e:
-		frappe.log_error(frappe.get_traceback(), "Click Callback Error")
+		log_callback_error("Click Callback Error")
 		
 		# Schedule retry on error
 		try:
-			if 'integration_request' in locals():
+			if 'integration_request' in locals() and integration_request:
 				WebhookRetry.schedule_retry(integration_request.name, 0)
 		except (NameError, AttributeError, Exception) as retry_error:
 			# Log retry scheduling error but don't fail the callback
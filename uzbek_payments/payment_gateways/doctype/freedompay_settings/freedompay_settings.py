@@ -42,19 +42,24 @@ FreedomPay will send callback to: /api/method/uzbek_payments.payment_gateways.do
 
 """
 
-import hashlib
 import hmac
 import json
-import time
 
 import frappe
 from frappe import _
-from frappe.integrations.utils import create_request_log, make_post_request
+from frappe.integrations.utils import create_request_log
 from frappe.model.document import Document
-from frappe.utils import call_hook_method, get_url
+from frappe.utils import call_hook_method, cstr, get_url
 
 from payments.utils import create_payment_gateway
-from uzbek_payments.metrics import PaymentMetrics
+from uzbek_payments.api_validators import APIResponseValidator
+from uzbek_payments.cache_utils import SettingsCache
+from uzbek_payments.callback_utils import handle_callback
+from uzbek_payments.http_utils import post_json
+from uzbek_payments.idempotency import PaymentIdempotency
+from uzbek_payments.rate_limiter import callback_rate_limiter
+from uzbek_payments.signature_utils import build_sign_string, decode_signature, hmac_sha256
+from uzbek_payments.validators import validate_order_id, validate_payment_amount
 
 
 class FreedomPaySettings(Document):
@@ -68,6 +73,9 @@ class FreedomPaySettings(Document):
 		if not self.flags.ignore_mandatory:
 			self.validate_credentials()
 
+	def on_update(self):
+		SettingsCache.clear_cache("FreedomPay")
+
 	def validate_credentials(self):
 		"""Validate FreedomPay credentials"""
 		if self.merchant_id and self.terminal_id and self.secret_key:
@@ -93,10 +101,6 @@ class FreedomPaySettings(Document):
 	def get_payment_url(self, **kwargs):
 		"""Generate payment URL for FreedomPay checkout"""
 		try:
-			from uzbek_payments.validators import validate_payment_amount, validate_order_id
-			from uzbek_payments.idempotency import PaymentIdempotency
-			from uzbek_payments.api_validators import APIResponseValidator
-			
 			order_id = kwargs.get("order_id")
 			amount = float(kwargs.get("amount", 0))
 			
@@ -152,15 +156,19 @@ class FreedomPaySettings(Document):
 				)
 				integration_request_dict["payment_url"] = payment_request.get("payment_url")
 				
-				# Store idempotency key
-				idempotency_key = PaymentIdempotency.generate_idempotency_key("FreedomPay", order_id)
-				integration_request_dict["idempotency_key"] = idempotency_key
+				# Store idempotency key with the same save
+				integration_request_dict["idempotency_key"] = PaymentIdempotency.generate_idempotency_key(
+					"FreedomPay", order_id
+				)
+				integration_request.idempotency_lookup = PaymentIdempotency.get_lookup_key("FreedomPay", order_id)
+				integration_request.ext_order_id = order_id
+				integration_request.ext_txn_id = cstr(payment_request.get("transaction_id")) or None
 				
 				integration_request.data = frappe.as_json(integration_request_dict)
 				integration_request.save(ignore_permissions=True)
 				frappe.db.commit()
 				
-				PaymentIdempotency.store_idempotency_key(integration_request.name, idempotency_key)
+				PaymentIdempotency.add_to_filter("FreedomPay", order_id)
 
 				return payment_request.get("payment_url")
 			else:
@@ -174,22 +182,26 @@ class FreedomPaySettings(Document):
 		"""Generate signature for FreedomPay request"""
 		# FreedomPay typically uses HMAC SHA256 or MD5 for signatures
 		# Adjust based on actual API documentation
-		sign_string = (
-			f"{data['merchant_id']}"
-			f"{data['terminal_id']}"
-			f"{data['amount']}"
-			f"{data['order_id']}"
-			f"{self.secret_key}"
+		secret_key = self._get_secret_key_bytes()
+		sign_string = build_sign_string(
+			data["merchant_id"],
+			data["terminal_id"],
+			data["amount"],
+			data["order_id"],
+			secret_key,
 		)
 
 		# Using SHA256 (adjust if FreedomPay uses different algorithm)
-		signature = hmac.new(
-			key=self.secret_key.encode("utf-8"),
-			msg=sign_string.encode("utf-8"),
-			digestmod=hashlib.sha256,
-		).hexdigest()
+		return hmac_sha256(secret_key, sign_string).hex()
 
-		return signature
+	def _get_secret_key_bytes(self):
+		"""Decrypted secret key as UTF-8 bytes, cached on the document"""
+		secret_key = getattr(self, "_secret_key_bytes", None)
+		if secret_key is None:
+			secret_key = self._secret_key_bytes = (
+				self.get_password("secret_key", raise_exception=False) or ""
+			).encode("utf-8")
+		return secret_key
 
 	def create_payment_request(self, payment_data):
 		"""Create payment request in FreedomPay system"""
@@ -201,40 +213,15 @@ class FreedomPaySettings(Document):
 			"Accept": "application/json",
 		}
 
-		try:
-			response = make_post_request(
-				url=url,
-				json=payment_data,
-				headers=headers,
-			)
-
-			return response
-		except Exception as e:
-			frappe.log_error(frappe.get_traceback(), "FreedomPay Create Payment Request Error")
-			raise
+		# Errors propagate to get_payment_url, which logs them once
+		return post_json(url, payment_data, headers)
 
 	def verify_signature(self, data, signature):
 		"""Verify FreedomPay callback signature"""
-		# Build sign string from callback data
-		sign_string = (
-			f"{data.get('merchant_id')}"
-			f"{data.get('terminal_id')}"
-			f"{data.get('transaction_id')}"
-			f"{data.get('order_id')}"
-			f"{data.get('amount')}"
-			f"{data.get('status')}"
-			f"{self.secret_key}"
+		return _verify_freedompay_signature(
+			data, signature, self.get_password("secret_key", raise_exception=False)
 		)
 
-		# Generate expected signature
-		expected_signature = hmac.new(
-			key=self.secret_key.encode("utf-8"),
-			msg=sign_string.encode("utf-8"),
-			digestmod=hashlib.sha256,
-		).hexdigest()
-
-		return hmac.compare_digest(expected_signature, signature)
-
 	@frappe.whitelist()
 	def clear(self):
 		"""Clear sensitive data"""
@@ -243,15 +230,41 @@ class FreedomPaySettings(Document):
 		self.save()
 
 
+def _verify_freedompay_signature(data, signature, secret_key):
+	"""
+	Verify FreedomPay callback signature
+	
+	Args:
+		data: Callback data
+		signature: Signature sent with the callback
+		secret_key: FreedomPay secret key
+		
+	Returns:
+		True if signature is valid
+	"""
+	provided = decode_signature(signature)
+	if not secret_key or not provided:
+		return False
+	
+	# Build sign string from callback data
+	secret_key = secret_key.encode("utf-8")
+	sign_string = build_sign_string(
+		data.get("merchant_id"),
+		data.get("terminal_id"),
+		data.get("transaction_id"),
+		data.get("order_id"),
+		data.get("amount"),
+		data.get("status"),
+		secret_key,
+	)
+
+	# Compare raw digests rather than hex strings
+	return hmac.compare_digest(hmac_sha256(secret_key, sign_string), provided)
+
+
 @frappe.whitelist(allow_guest=True)
 def callback():
 	"""Handle FreedomPay payment callback"""
-	from uzbek_payments.lock_utils import payment_lock
-	from uzbek_payments.webhook_retry import WebhookRetry
-	from uzbek_payments.rate_limiter import callback_rate_limiter
-	
-	callback_start_time = time.time()
-	
 	# Apply rate limiting
 	try:
 		ip_address = frappe.local.request.remote_addr if hasattr(frappe.local, 'request') else "unknown"
@@ -259,158 +272,65 @@ def callback():
 		ip_address = "unknown"
 	
 	if not callback_rate_limiter.check_rate_limit(ip_address):
-		from frappe import _
 		frappe.throw(
 			_("Rate limit exceeded. Please try again later."),
 			exc=frappe.ValidationError
 		)
 	
-	try:
-		data = frappe.local.form_dict
-		headers = frappe.request.headers
-
-		# Get signature from headers or data
-		signature = (
-			headers.get("X-FreedomPay-Signature")
-			or headers.get("Signature")
-			or data.get("signature")
-		)
-
-		if not signature:
-			frappe.throw(_("Missing signature in callback"))
-
-		# Get FreedomPay settings
-		settings = frappe.get_doc("FreedomPay Settings")
-
-		# Verify signature
-		if not settings.verify_signature(data, signature):
-			frappe.throw(_("Invalid signature"), exc=frappe.PermissionError)
-
-		# Process callback
-		transaction_id = data.get("transaction_id")
-		order_id = data.get("order_id")
-		status = data.get("status")
-		amount = data.get("amount")
-		
-		# Prepare lock key safely
-		lock_key = order_id or transaction_id or str(transaction_id) if transaction_id else "unknown"
-		
-		# Use lock to prevent race conditions
-		with payment_lock(lock_key):
-			# Find integration request - escape order_id to prevent SQL injection
-			integration_requests = []
-			if order_id:
-				# Escape order_id to prevent SQL injection
-				escaped_order_id = frappe.db.escape(order_id)
-				integration_requests = frappe.get_all(
-					"Integration Request",
-					filters={
-						"integration_request_service": "FreedomPay",
-						"data": ["like", f'%"order_id": {escaped_order_id}%'],
-					},
-					fields=["name", "data", "reference_doctype", "reference_docname"],
-					order_by="creation desc",
-					limit=1,
-				)
-			
-			# If not found by order_id, try to find by transaction_id
-			if not integration_requests and transaction_id:
-				# Escape transaction_id to prevent SQL injection
-				escaped_transaction_id = frappe.db.escape(str(transaction_id))
-				integration_requests = frappe.get_all(
-					"Integration Request",
-					filters={
-						"integration_request_service": "FreedomPay",
-						"data": ["like", f'%"freedompay_transaction_id": {escaped_transaction_id}%'],
-					},
-					fields=["name", "data", "reference_doctype", "reference_docname"],
-					order_by="creation desc",
-					limit=1,
-				)
-
-			if not integration_requests:
-				frappe.throw(_("Integration Request not found"))
-
-			integration_request = frappe.get_doc("Integration Request", integration_requests[0].name)
-			integration_request_dict = frappe.parse_json(integration_request.data) or {}
-
-			# Update with payment information
-			integration_request_dict.update(
-				{
-					"freedompay_transaction_id": transaction_id,
-					"status": status,
-					"amount": amount,
-				}
-			)
-
-			integration_request.data = frappe.as_json(integration_request_dict)
-
-			# Handle payment status
-			# Adjust status values based on actual FreedomPay API
-			if status in ("success", "completed", "paid", "1"):
-				integration_request.status = "Completed"
-				integration_request.save(ignore_permissions=True)
-				frappe.db.commit()
-
-				# Record metrics for successful payment
-				duration = time.time() - callback_start_time
-				payment_amount = amount or (integration_request_dict.get("amount", 0) / 100 if integration_request_dict.get("amount") else 0)
-				PaymentMetrics.record_payment("FreedomPay", payment_amount, "Completed", duration, None)
-
-				# Call on_payment_authorized
-				if integration_request.reference_doctype and integration_request.reference_docname:
-					try:
-						doc = frappe.get_doc(
-							integration_request.reference_doctype, integration_request.reference_docname
-						)
-						doc.run_method("on_payment_authorized", "Completed")
-						
-						# Integrate with accounting and banking modules
-						try:
-							from uzbek_payments.integrations import integrate_with_accounting, integrate_with_banking
-							integrate_with_accounting(doc.as_dict())
-							integrate_with_banking({"payment_entry": doc.name})
-						except Exception as integration_error:
-							# Log integration errors but don't fail the payment
-							frappe.log_error(
-								message=f"Integration error: {str(integration_error)}",
-								title="Payment Integration Error"
-							)
-					except Exception as doc_error:
-						frappe.log_error(frappe.get_traceback(), "FreedomPay Callback - Document Processing Error")
-
-				return {"status": "success", "message": "Payment processed successfully"}
-			else:
-				integration_request.status = "Failed"
-				integration_request.error = f"Payment status: {status}"
-				integration_request.save(ignore_permissions=True)
-				frappe.db.commit()
-				
-				# Record metrics for failed payment
-				duration = time.time() - callback_start_time
-				payment_amount = amount or (integration_request_dict.get("amount", 0) / 100 if integration_request_dict.get("amount") else 0)
-				PaymentMetrics.record_payment("FreedomPay", payment_amount, "Failed", duration, f"Status: {status}")
-				
-				# Schedule retry for failed webhook
-				WebhookRetry.schedule_retry(integration_request.name, 0)
+	# Adjust status values based on actual FreedomPay API
+	return handle_callback(
+		"FreedomPay",
+		verify=_verify_freedompay_callback,
+		parse=_parse_freedompay_callback,
+		success_statuses=("success", "completed", "paid", "1"),
+		respond=_freedompay_response,
+	)
+
+
+def _verify_freedompay_callback(data):
+	"""Check the FreedomPay callback signature against the cached secret key"""
+	headers = frappe.request.headers
+
+	# Get signature from headers or data
+	signature = (
+		headers.get("X-FreedomPay-Signature")
+		or headers.get("Signature")
+		or data.get("signature")
+	)
+
+	if not signature:
+		frappe.throw(_("Missing signature in callback"))
+
+	# Get cached FreedomPay settings
+	settings = SettingsCache.get_settings("FreedomPay") or {}
+
+	return _verify_freedompay_signature(data, signature, settings.get("secret_key"))
+
+
+def _parse_freedompay_callback(data):
+	"""Extract payment details from FreedomPay callback data"""
+	transaction_id = data.get("transaction_id")
+	status = data.get("status")
+	amount = data.get("amount")
+
+	return {
+		"order_id": data.get("order_id"),
+		"txn_id": transaction_id,
+		"status": status,
+		"amount": amount,
+		"updates": {
+			"freedompay_transaction_id": transaction_id,
+			"status": status,
+			"amount": amount,
+		},
+	}
 
-				return {"status": "failed", "message": f"Payment {status}"}
 
-	except Exception as e:
-		frappe.log_error(frappe.get_traceback(), "FreedomPay Callback Error")
-		
-		# Schedule retry on error
-		try:
-			if 'integration_request' in locals():
-				WebhookRetry.schedule_retry(integration_request.name, 0)
-		except (NameError, AttributeError, Exception) as retry_error:
-			# Log retry scheduling error but don't fail the callback
-			frappe.log_error(
-				message=f"Error scheduling webhook retry: {str(retry_error)}",
-				title="Webhook Retry Scheduling Error"
-			)
-		
-		return {"status": "error", "message": str(e)}
+def _freedompay_response(status, message=None):
+	"""Wrap a callback outcome in FreedomPay's response format"""
+	if status == "success":
+		message = "Payment processed successfully"
+	return {"status": status, "message": message}
 
 
 @frappe.whitelist()
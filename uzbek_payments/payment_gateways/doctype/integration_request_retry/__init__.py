@@ -0,0 +1,3 @@
+from .integration_request_retry import IntegrationRequestRetry
+
+__all__ = ["IntegrationRequestRetry"]
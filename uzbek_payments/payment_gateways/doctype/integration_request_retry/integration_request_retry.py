@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+Queued webhook retry for an Integration Request
+
+Rows are written by WebhookRetry.schedule_retry and consumed by
+uzbek_payments.webhook_retry.process_pending_retries.
+"""
+
+from frappe.model.document import Document
+
+
+class IntegrationRequestRetry(Document):
+	pass
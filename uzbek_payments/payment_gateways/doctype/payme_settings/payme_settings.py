@@ -42,19 +42,24 @@ Payme will send callback to: /api/method/uzbek_payments.payment_gateways.doctype
 
 """
 
-import hashlib
 import hmac
 import json
-import time
 
 import frappe
 from frappe import _
-from frappe.integrations.utils import create_request_log, make_post_request
+from frappe.integrations.utils import create_request_log
 from frappe.model.document import Document
-from frappe.utils import call_hook_method, get_url
+from frappe.utils import call_hook_method, cstr, get_url
 
 from payments.utils import create_payment_gateway
-from uzbek_payments.metrics import PaymentMetrics
+from uzbek_payments.api_validators import APIResponseValidator
+from uzbek_payments.cache_utils import SettingsCache
+from uzbek_payments.callback_utils import handle_callback
+from uzbek_payments.http_utils import post_json
+from uzbek_payments.idempotency import PaymentIdempotency
+from uzbek_payments.rate_limiter import callback_rate_limiter
+from uzbek_payments.signature_utils import decode_signature, hmac_sha256
+from uzbek_payments.validators import validate_order_id, validate_payment_amount
 
 
 class PaymeSettings(Document):
@@ -68,6 +73,9 @@ class PaymeSettings(Document):
 		if not self.flags.ignore_mandatory:
 			self.validate_credentials()
 
+	def on_update(self):
+		SettingsCache.clear_cache("Payme")
+
 	def validate_credentials(self):
 		"""Validate Payme credentials"""
 		if self.merchant_id and self.merchant_key:
@@ -90,10 +98,6 @@ class PaymeSettings(Document):
 	def get_payment_url(self, **kwargs):
 		"""Generate payment URL for Payme checkout"""
 		try:
-			from uzbek_payments.validators import validate_payment_amount, validate_order_id
-			from uzbek_payments.idempotency import PaymentIdempotency
-			from uzbek_payments.api_validators import APIResponseValidator
-			
 			order_id = kwargs.get("order_id")
 			amount = float(kwargs.get("amount", 0))
 			
@@ -143,15 +147,19 @@ class PaymeSettings(Document):
 				integration_request_dict["payme_payment_id"] = payment_request.get("result", {}).get("id")
 				integration_request_dict["payment_url"] = payment_request.get("result", {}).get("checkout_url")
 				
-				# Store idempotency key
-				idempotency_key = PaymentIdempotency.generate_idempotency_key("Payme", order_id)
-				integration_request_dict["idempotency_key"] = idempotency_key
+				# Store idempotency key with the same save
+				integration_request_dict["idempotency_key"] = PaymentIdempotency.generate_idempotency_key(
+					"Payme", order_id
+				)
+				integration_request.idempotency_lookup = PaymentIdempotency.get_lookup_key("Payme", order_id)
+				integration_request.ext_order_id = order_id
+				integration_request.ext_txn_id = cstr(payment_request.get("result", {}).get("id")) or None
 				
 				integration_request.data = frappe.as_json(integration_request_dict)
 				integration_request.save(ignore_permissions=True)
 				frappe.db.commit()
 				
-				PaymentIdempotency.store_idempotency_key(integration_request.name, idempotency_key)
+				PaymentIdempotency.add_to_filter("Payme", order_id)
 
 				return payment_request.get("result", {}).get("checkout_url")
 			else:
@@ -170,28 +178,14 @@ class PaymeSettings(Document):
 			"X-Auth": self.merchant_key,
 		}
 
-		try:
-			response = make_post_request(
-				url=url,
-				json=payment_data,
-				headers=headers,
-			)
-
-			return response
-		except Exception as e:
-			frappe.log_error(frappe.get_traceback(), "Payme Create Payment Request Error")
-			raise
+		# Errors propagate to get_payment_url, which logs them once
+		return post_json(url, payment_data, headers)
 
-	def verify_signature(self, data, signature):
+	def verify_signature(self, data, signature, raw_body=None):
 		"""Verify Payme callback signature"""
-		# Payme uses HMAC SHA256 for signature verification
-		expected_signature = hmac.new(
-			key=self.merchant_key.encode("utf-8"),
-			msg=json.dumps(data, sort_keys=True).encode("utf-8"),
-			digestmod=hashlib.sha256,
-		).hexdigest()
-
-		return hmac.compare_digest(expected_signature, signature)
+		return _verify_payme_signature(
+			data, signature, self.get_password("merchant_key", raise_exception=False), raw_body
+		)
 
 	@frappe.whitelist()
 	def clear(self):
@@ -201,155 +195,92 @@ class PaymeSettings(Document):
 		self.save()
 
 
-@frappe.whitelist(allow_guest=True)
-@frappe.get_attr("uzbek_payments.rate_limiter.callback_rate_limiter").rate_limit_callback
-def callback():
-	"""Handle Payme payment callback"""
-	from uzbek_payments.lock_utils import payment_lock
-	from uzbek_payments.webhook_retry import WebhookRetry
+def _verify_payme_signature(data, signature, merchant_key, raw_body=None):
+	"""
+	Verify Payme callback signature
 	
-	callback_start_time = time.time()
+	The raw request body is what the sender signed, so it is checked
+	first; the sorted JSON form of the parsed data is the fallback.
 	
-	try:
-		data = frappe.local.form_dict
-		headers = frappe.request.headers
-
-		# Get signature from headers
-		signature = headers.get("X-Payme-Signature") or headers.get("Authorization")
-
-		if not signature:
-			frappe.throw(_("Missing signature in callback"))
-
-		# Get Payme settings
-		settings = frappe.get_doc("Payme Settings")
-
-		# Verify signature
-		if not settings.verify_signature(data, signature):
-			frappe.throw(_("Invalid signature"), exc=frappe.PermissionError)
-
-		# Process callback
-		payment_id = data.get("id")
-		account_data = data.get("account", {})
-		order_id = account_data.get("order_id") if account_data else None
-		status = data.get("status")
-		
-		# Prepare lock key safely
-		lock_key = order_id or payment_id or str(payment_id) if payment_id else "unknown"
+	Args:
+		data: Callback data
+		signature: Signature sent with the callback
+		merchant_key: Payme merchant key
+		raw_body: Raw request body, if available
 		
-		# Use lock to prevent race conditions
-		with payment_lock(lock_key):
-			# Find integration request - escape order_id to prevent SQL injection
-			integration_requests = []
-			if order_id:
-				# Escape order_id to prevent SQL injection
-				escaped_order_id = frappe.db.escape(order_id)
-				integration_requests = frappe.get_all(
-					"Integration Request",
-					filters={
-						"integration_request_service": "Payme",
-						"data": ["like", f'%"order_id": {escaped_order_id}%'],
-					},
-					fields=["name", "data", "reference_doctype", "reference_docname"],
-					order_by="creation desc",
-					limit=1,
-				)
-			
-			# If not found by order_id, try to find by payment_id
-			if not integration_requests and payment_id:
-				# Escape payment_id to prevent SQL injection
-				escaped_payment_id = frappe.db.escape(str(payment_id))
-				integration_requests = frappe.get_all(
-					"Integration Request",
-					filters={
-						"integration_request_service": "Payme",
-						"data": ["like", f'%"payme_payment_id": {escaped_payment_id}%'],
-					},
-					fields=["name", "data", "reference_doctype", "reference_docname"],
-					order_by="creation desc",
-					limit=1,
-				)
-
-			if not integration_requests:
-				frappe.throw(_("Integration Request not found"))
+	Returns:
+		True if signature is valid
+	"""
+	provided = decode_signature(signature)
+	if not merchant_key or not provided:
+		return False
+	
+	# Payme uses HMAC SHA256 for signature verification; digests are
+	# compared as raw bytes
+	merchant_key = merchant_key.encode("utf-8")
+	if raw_body and hmac.compare_digest(hmac_sha256(merchant_key, raw_body), provided):
+		return True
 
-			integration_request = frappe.get_doc("Integration Request", integration_requests[0].name)
-			integration_request_dict = frappe.parse_json(integration_request.data) or {}
+	expected_signature = hmac_sha256(merchant_key, json.dumps(data, sort_keys=True).encode("utf-8"))
 
-			# Update with payment information
-			integration_request_dict.update(
-				{
-					"payme_payment_id": payment_id,
-					"status": status,
-				}
-			)
+	return hmac.compare_digest(expected_signature, provided)
 
-			integration_request.data = frappe.as_json(integration_request_dict)
-
-			# Handle payment status
-			if status == "paid" or status == "completed":
-				integration_request.status = "Completed"
-				integration_request.save(ignore_permissions=True)
-				frappe.db.commit()
 
-				# Record metrics for successful payment
-				duration = time.time() - callback_start_time
-				amount = integration_request_dict.get("amount", 0) / 100 if integration_request_dict.get("amount") else 0
-				PaymentMetrics.record_payment("Payme", amount, "Completed", duration, None)
-
-				# Call on_payment_authorized
-				if integration_request.reference_doctype and integration_request.reference_docname:
-					try:
-						doc = frappe.get_doc(
-							integration_request.reference_doctype, integration_request.reference_docname
-						)
-						doc.run_method("on_payment_authorized", "Completed")
-						
-						# Integrate with accounting and banking modules
-						try:
-							from uzbek_payments.integrations import integrate_with_accounting, integrate_with_banking
-							integrate_with_accounting(doc.as_dict())
-							integrate_with_banking({"payment_entry": doc.name})
-						except Exception as integration_error:
-							# Log integration errors but don't fail the payment
-							frappe.log_error(
-								message=f"Integration error: {str(integration_error)}",
-								title="Payment Integration Error"
-							)
-					except Exception as doc_error:
-						frappe.log_error(frappe.get_traceback(), "Payme Callback - Document Processing Error")
-
-				return {"result": {"status": "success"}}
-			else:
-				integration_request.status = "Failed"
-				integration_request.error = f"Payment status: {status}"
-				integration_request.save(ignore_permissions=True)
-				frappe.db.commit()
-				
-				# Record metrics for failed payment
-				duration = time.time() - callback_start_time
-				amount = integration_request_dict.get("amount", 0) / 100 if integration_request_dict.get("amount") else 0
-				PaymentMetrics.record_payment("Payme", amount, "Failed", duration, f"Status: {status}")
-				
-				# Schedule retry for failed webhook
-				WebhookRetry.schedule_retry(integration_request.name, 0)
+@frappe.whitelist(allow_guest=True)
+@callback_rate_limiter.rate_limit_callback
+def callback():
+	"""Handle Payme payment callback"""
+	return handle_callback(
+		"Payme",
+		verify=_verify_payme_callback,
+		parse=_parse_payme_callback,
+		success_statuses=("paid", "completed"),
+		respond=_payme_response,
+	)
+
+
+def _verify_payme_callback(data):
+	"""Check the Payme callback signature against the cached merchant key"""
+	headers = frappe.request.headers
+
+	# Get signature from headers
+	signature = headers.get("X-Payme-Signature") or headers.get("Authorization")
+
+	if not signature:
+		frappe.throw(_("Missing signature in callback"))
+
+	# Get cached Payme settings
+	settings = SettingsCache.get_settings("Payme") or {}
+
+	return _verify_payme_signature(
+		data, signature, settings.get("merchant_key"), frappe.request.get_data(cache=True)
+	)
+
+
+def _parse_payme_callback(data):
+	"""Extract payment details from Payme callback data"""
+	payment_id = data.get("id")
+	account_data = data.get("account", {})
+	order_id = account_data.get("order_id") if account_data else None
+	status = data.get("status")
+
+	return {
+		"order_id": order_id,
+		"txn_id": payment_id,
+		"status": status,
+		"updates": {
+			"payme_payment_id": payment_id,
+			"status": status,
+		},
+	}
 
-				return {"result": {"status": "failed", "message": f"Payment {status}"}}
 
-	except Exception as e:
-		frappe.log_error(frappe.get_traceback(), "Payme Callback Error")
-		
-		# Schedule retry on error
-		try:
-			if 'integration_request' in locals():
-				WebhookRetry.schedule_retry(integration_request.name, 0)
-		except (NameError, AttributeError, Exception) as retry_error:
-			# Log retry scheduling error but don't fail the callback
-			frappe.log_error(
-				message=f"Error scheduling webhook retry: {str(retry_error)}",
-				title="Webhook Retry Scheduling Error"
-			)
-		
-		return {"result": {"status": "error", "message": str(e)}}
+def _payme_response(status, message=None):
+	"""Wrap a callback outcome in Payme's response format"""
+	result = {"status": status}
+	if message is not None:
+		result["message"] = message
+	return {"result": result}
 
 
 @frappe.whitelist()
@@ -5,12 +5,31 @@
 Rate limiter for payment callbacks
 """
 
+import random
+import secrets
 import time
 import frappe
-from collections import defaultdict
+from collections import defaultdict, deque
 from functools import wraps
 from typing import Optional
 
+from uzbek_payments.cache_utils import get_cache
+
+# Chance per allowed call of sweeping idle IPs from the fallback window
+IDLE_SWEEP_PROBABILITY = 0.001
+
+# Sliding window check; the call is recorded only if it is allowed.
+# ARGV: now, window start, max calls, member, period. Returns 1 if allowed.
+_SLIDING_WINDOW_SCRIPT = """
+redis.call('zremrangebyscore', KEYS[1], '-inf', ARGV[2])
+if redis.call('zcard', KEYS[1]) >= tonumber(ARGV[3]) then
+	return 0
+end
+redis.call('zadd', KEYS[1], ARGV[1], ARGV[4])
+redis.call('expire', KEYS[1], ARGV[5])
+return 1
+"""
+
 
 class CallbackRateLimiter:
 	"""Rate limiter for payment callbacks"""
@@ -25,12 +44,15 @@ class CallbackRateLimiter:
 		"""
 		self.max_calls = max_calls
 		self.period = period
-		self.calls = defaultdict(list)
+		self.calls = defaultdict(lambda: deque(maxlen=self.max_calls))
 
 	def check_rate_limit(self, ip_address: str) -> bool:
 		"""
 		Check if rate limit is exceeded
 		
+		Uses a Redis sorted-set sliding window so the limit is shared by
+		all workers. Falls back to a per-process window if Redis fails.
+		
 		Args:
 			ip_address: IP address
 			
@@ -38,17 +60,47 @@ class CallbackRateLimiter:
 			True if within limit, False otherwise
 		"""
 		now = time.time()
+		try:
+			cache = get_cache()
+			key = cache.make_key(f"callback_rate_limit_{ip_address}")
+			allowed = cache.eval(
+				_SLIDING_WINDOW_SCRIPT,
+				1,
+				key,
+				now,
+				now - self.period,
+				self.max_calls,
+				f"{now}:{secrets.token_hex(4)}",
+				self.period,
+			)
+		except Exception:
+			return self._check_local_rate_limit(ip_address, now)
+		
+		return bool(allowed)
+
+	def _check_local_rate_limit(self, ip_address: str, now: float) -> bool:
+		"""Per-process sliding window used when Redis is unavailable"""
+		cutoff = now - self.period
 		ip_calls = self.calls[ip_address]
 		
-		# Remove old calls
-		ip_calls[:] = [call_time for call_time in ip_calls if now - call_time < self.period]
+		# Calls are appended in time order, so expired ones are at the left
+		while ip_calls and ip_calls[0] < cutoff:
+			ip_calls.popleft()
 		
 		if len(ip_calls) >= self.max_calls:
 			return False
 		
 		ip_calls.append(now)
+		if random.random() < IDLE_SWEEP_PROBABILITY:
+			self._sweep_idle(cutoff)
 		return True
 
+	def _sweep_idle(self, cutoff: float):
+		"""Forget IPs with no calls inside the current window"""
+		idle = [ip for ip, ip_calls in self.calls.items() if not ip_calls or ip_calls[-1] < cutoff]
+		for ip in idle:
+			del self.calls[ip]
+
 	def rate_limit_callback(self, func):
 		"""
 		Decorator for rate limiting callbacks
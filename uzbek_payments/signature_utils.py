@@ -0,0 +1,87 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+Signature utilities for payment gateways
+"""
+
+import hashlib
+import hmac
+from functools import lru_cache
+from typing import Optional
+
+# Size of an HMAC-SHA256 digest in bytes
+HMAC_SHA256_SIZE = 32
+
+
+@lru_cache(maxsize=8)
+def _hmac_sha256_template(key: bytes) -> hmac.HMAC:
+	"""
+	HMAC-SHA256 object with the key already absorbed
+	
+	Keys only change when an admin edits gateway settings, so the padded
+	key blocks are derived once per key and copied for each message.
+	"""
+	return hmac.new(key, digestmod=hashlib.sha256)
+
+
+def hmac_sha256(key: bytes, msg: bytes) -> bytes:
+	"""
+	HMAC-SHA256 digest of a message
+	
+	Args:
+		key: Secret key bytes
+		msg: Message bytes
+		
+	Returns:
+		Raw 32-byte digest
+	"""
+	h = _hmac_sha256_template(key).copy()
+	h.update(msg)
+	return h.digest()
+
+
+def build_sign_string(*values) -> bytes:
+	"""
+	Concatenate sign-string fields straight into bytes
+	
+	Args:
+		values: Field values in protocol order; bytes are used as-is
+		
+	Returns:
+		Sign string bytes
+	"""
+	return b"".join(tuple(map(_sign_bytes, values)))
+
+
+def _sign_bytes(value) -> bytes:
+	"""Encode one sign-string field"""
+	if isinstance(value, bytes):
+		return value
+	# Ints (e.g. amounts in tiyin) are formatted straight to bytes; bool is
+	# excluded since str(True) and b"%d" % True differ
+	if type(value) is int:
+		return b"%d" % value
+	return str(value).encode("utf-8")
+
+
+def decode_signature(signature: str, size: int = HMAC_SHA256_SIZE) -> Optional[bytes]:
+	"""
+	Decode a hex signature to raw bytes
+	
+	Signatures of the wrong length are rejected before decoding; the
+	length of a digest is public, so this leaks nothing.
+	
+	Args:
+		signature: Hex signature sent by the gateway
+		size: Expected digest size in bytes
+		
+	Returns:
+		Signature bytes, or None if it is not valid hex of that size
+	"""
+	if not isinstance(signature, str) or len(signature) != size * 2:
+		return None
+	try:
+		return bytes.fromhex(signature)
+	except ValueError:
+		return None
@@ -0,0 +1,79 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+Tests for shared payment callback handling
+"""
+
+import unittest
+from contextlib import nullcontext
+from unittest.mock import call, patch
+
+import frappe
+
+from uzbek_payments.callback_utils import handle_callback
+
+
+class TestHandleCallback(unittest.TestCase):
+	"""Tests for handle_callback"""
+
+	def setUp(self):
+		integration_request = frappe._dict(
+			name="IR-00001",
+			data='{"amount": 100000}',
+			reference_doctype="Payment Request",
+			reference_docname="PR-00001",
+		)
+		patches = {
+			"find": patch(
+				"uzbek_payments.callback_utils.find_integration_request",
+				return_value=integration_request,
+			),
+			"lock": patch(
+				"uzbek_payments.callback_utils.payment_lock", side_effect=lambda key: nullcontext()
+			),
+			"metrics": patch("uzbek_payments.callback_utils.PaymentMetrics"),
+			"log": patch("uzbek_payments.callback_utils.log_callback_error"),
+			"enqueue": patch("uzbek_payments.callback_utils.enqueue_payment_integrations"),
+			"db": patch("uzbek_payments.callback_utils.frappe.db"),
+			"get_doc": patch("uzbek_payments.callback_utils.frappe.get_doc"),
+		}
+		self.mocks = {name: p.start() for name, p in patches.items()}
+		for p in patches.values():
+			self.addCleanup(p.stop)
+
+		form_dict = patch.object(frappe.local, "form_dict", frappe._dict(order_id="ORD-1"), create=True)
+		form_dict.start()
+		self.addCleanup(form_dict.stop)
+
+	def _handle(self):
+		return handle_callback(
+			"Payme",
+			verify=lambda data: True,
+			parse=lambda data: {"order_id": data.order_id, "status": "paid", "updates": {}},
+			success_statuses=("paid",),
+			respond=lambda status, message=None: {"status": status},
+		)
+
+	def test_missing_reference_document_keeps_completed(self):
+		"""Test a reference document that fails to load is rolled back to the savepoint"""
+		self.mocks["get_doc"].side_effect = frappe.DoesNotExistError
+		db = self.mocks["db"]
+
+		self.assertEqual(self._handle(), {"status": "success"})
+
+		completed = db.set_value.call_args
+		self.assertEqual(completed.args[2]["status"], "Completed")
+		db.assert_has_calls(
+			[
+				call.savepoint("on_payment_authorized"),
+				call.rollback(save_point="on_payment_authorized"),
+				call.commit(),
+			]
+		)
+		self.mocks["log"].assert_called_once()
+		self.mocks["enqueue"].assert_not_called()
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -11,6 +11,7 @@ from unittest.mock import patch
 import frappe
 from frappe.tests.utils import FrappeTestCase
 
+from uzbek_payments import db_utils
 from uzbek_payments.db_utils import (
 	is_postgres,
 	is_mysql,
@@ -19,6 +20,7 @@ from uzbek_payments.db_utils import (
 	get_year_function,
 	get_date_trunc,
 	get_database_function,
+	load_json_data,
 )
 
 
@@ -39,20 +41,42 @@ class TestDBUtils(FrappeTestCase):
 		self.assertTrue(is_mysql())
 		self.assertFalse(is_postgres())
 
-	@patch("uzbek_payments.db_utils.is_postgres")
-	def test_get_table_name_postgres(self, mock_is_postgres):
+	def tearDown(self):
+		# Restore dialect resolved from the real database
+		db_utils._rebind()
+
+	@patch("uzbek_payments.db_utils.frappe.db")
+	def test_get_table_name_postgres(self, mock_db):
 		"""Test table name formatting for PostgreSQL"""
-		mock_is_postgres.return_value = True
+		mock_db.db_type = "postgres"
+		db_utils._rebind()
 		result = get_table_name("tabPayment Entry")
 		self.assertEqual(result, '"tabPayment Entry"')
 
-	@patch("uzbek_payments.db_utils.is_postgres")
-	def test_get_table_name_mysql(self, mock_is_postgres):
+	@patch("uzbek_payments.db_utils.frappe.db")
+	def test_get_table_name_mysql(self, mock_db):
 		"""Test table name formatting for MySQL"""
-		mock_is_postgres.return_value = False
+		mock_db.db_type = "mariadb"
+		db_utils._rebind()
 		result = get_table_name("tabPayment Entry")
 		self.assertEqual(result, "`tabPayment Entry`")
 
+	@patch("uzbek_payments.db_utils.frappe.db")
+	def test_format_sql_query_postgres(self, mock_db):
+		"""Test backtick replacement for PostgreSQL"""
+		mock_db.db_type = "postgres"
+		db_utils._rebind()
+		result = format_sql_query("SELECT `name` FROM `tabPayment Entry`")
+		self.assertEqual(result, 'SELECT "name" FROM "tabPayment Entry"')
+
+	def test_load_json_data(self):
+		"""Test JSON data columns are parsed, and parsed dicts passed through"""
+		data = {"amount": 1000}
+		self.assertIs(load_json_data(data), data)
+		self.assertEqual(load_json_data('{"amount": 1000}'), data)
+		self.assertEqual(load_json_data(None), {})
+		self.assertEqual(load_json_data(""), {})
+
 
 if __name__ == "__main__":
 	unittest.main()
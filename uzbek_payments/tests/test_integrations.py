@@ -6,42 +6,60 @@ Tests for module integrations
 """
 
 import unittest
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch
 
 import frappe
-from frappe.tests.utils import FrappeTestCase
 
 from uzbek_payments.integrations import (
 	_is_module_installed,
+	clear_module_cache,
 	integrate_with_accounting,
 	integrate_with_banking,
 	get_available_integrations,
 )
 
 
-class TestIntegrations(FrappeTestCase):
-	"""Tests for module integrations"""
+class TestIntegrations(unittest.TestCase):
+	"""
+	Tests for module integrations
+	
+	Database access is mocked throughout, so these skip FrappeTestCase's
+	per-class transaction setup; bench run-tests still connects the site.
+	"""
 
-	@patch("uzbek_payments.integrations.frappe.db.exists")
-	def test_is_module_installed_true(self, mock_exists):
-		"""Test module installation check - installed"""
-		mock_exists.return_value = True
-		
-		with patch("uzbek_payments.integrations.frappe.get_doc") as mock_get_doc:
-			mock_module = MagicMock()
-			mock_module.get.return_value = False
-			mock_get_doc.return_value = mock_module
-			
-			result = _is_module_installed("Uzbek Banking")
-			self.assertTrue(result)
+	def setUp(self):
+		clear_module_cache()
+
+	def tearDown(self):
+		clear_module_cache()
 
-	@patch("uzbek_payments.integrations.frappe.db.exists")
-	def test_is_module_installed_false(self, mock_exists):
-		"""Test module installation check - not installed"""
-		mock_exists.return_value = False
+	@patch("uzbek_payments.integrations.frappe.db.get_value")
+	def test_is_module_installed(self, mock_get_value):
+		"""Test module installation check"""
+		cases = (
+			("installed", frappe._dict(name="Uzbek Banking", disabled=0), True),
+			("disabled", frappe._dict(name="Uzbek Banking", disabled=1), False),
+			("not installed", None, False),
+		)
+		for label, module, expected in cases:
+			with self.subTest(label):
+				clear_module_cache()
+				mock_get_value.return_value = module
+				self.assertEqual(_is_module_installed("Uzbek Banking"), expected)
+
+	@patch("uzbek_payments.integrations.frappe.db.get_value")
+	def test_is_module_installed_cached(self, mock_get_value):
+		"""Test module installation state is read once until the cache is cleared"""
+		mock_get_value.return_value = frappe._dict(name="Uzbek Banking", disabled=0)
+		
+		self.assertTrue(_is_module_installed("Uzbek Banking"))
+		self.assertTrue(_is_module_installed("Uzbek Banking"))
+		self.assertEqual(mock_get_value.call_count, 1)
 		
-		result = _is_module_installed("Uzbek Banking")
-		self.assertFalse(result)
+		clear_module_cache()
+		mock_get_value.return_value = None
+		self.assertFalse(_is_module_installed("Uzbek Banking"))
+		self.assertEqual(mock_get_value.call_count, 2)
 
 	def test_integrate_with_accounting(self):
 		"""Test accounting integration"""
@@ -52,15 +70,16 @@ class TestIntegrations(FrappeTestCase):
 			self.fail("integrate_with_accounting raised an exception")
 
 	@patch("uzbek_payments.integrations._is_module_installed")
-	def test_integrate_with_banking_installed(self, mock_is_installed):
-		"""Test banking integration when module is installed"""
-		mock_is_installed.return_value = True
-		
+	def test_integrate_with_banking(self, mock_is_installed):
+		"""Test banking integration with and without the module installed"""
 		bank_transaction_data = {"name": "BT-00001", "amount": 1000}
-		try:
-			integrate_with_banking(bank_transaction_data)
-		except Exception:
-			self.fail("integrate_with_banking raised an exception")
+		for installed in (True, False):
+			with self.subTest(installed=installed):
+				mock_is_installed.return_value = installed
+				try:
+					integrate_with_banking(bank_transaction_data)
+				except Exception:
+					self.fail("integrate_with_banking raised an exception")
 
 	@patch("uzbek_payments.integrations._is_module_installed")
 	def test_get_available_integrations(self, mock_is_installed):
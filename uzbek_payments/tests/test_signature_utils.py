@@ -0,0 +1,150 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+Tests for gateway signature helpers
+
+Expected values are built the way the gateways were signed before the
+byte-level helpers: f-strings encoded as UTF-8 and hmac.new/hashlib.md5.
+"""
+
+import hashlib
+import hmac
+import json
+import unittest
+
+from uzbek_payments.payment_gateways.doctype.click_settings.click_settings import (
+	_md5_hexdigest,
+	_verify_click_signature,
+)
+from uzbek_payments.payment_gateways.doctype.freedompay_settings.freedompay_settings import (
+	_verify_freedompay_signature,
+)
+from uzbek_payments.payment_gateways.doctype.payme_settings.payme_settings import (
+	_verify_payme_signature,
+)
+from uzbek_payments.signature_utils import build_sign_string, decode_signature, hmac_sha256
+
+SECRET_KEY = "s3cr3t-ключ"
+
+
+def _hmac_hex(key, msg):
+	return hmac.new(key=key.encode("utf-8"), msg=msg.encode("utf-8"), digestmod=hashlib.sha256).hexdigest()
+
+
+class TestSignatureUtils(unittest.TestCase):
+	"""Tests for signature_utils"""
+
+	def test_build_sign_string(self):
+		"""Test sign strings match f-string formatting for every field type"""
+		cases = (
+			("int", (1000,), "1000"),
+			("negative int", (-5017,), "-5017"),
+			("str", ("ORD-1",), "ORD-1"),
+			("non-ascii str", ("Тошкент",), "Тошкент"),
+			("None", (None,), "None"),
+			("bool", (True, False), "TrueFalse"),
+			("float", (10.5,), "10.5"),
+			("mixed", ("M1", 2, None, "ORD-1"), "M12NoneORD-1"),
+		)
+		for label, values, expected in cases:
+			with self.subTest(label):
+				self.assertEqual(build_sign_string(*values), expected.encode("utf-8"))
+		
+		self.assertEqual(build_sign_string("a", b"\x00raw"), b"a\x00raw")
+
+	def test_hmac_sha256(self):
+		"""Test digests match hmac.new for repeated and different keys"""
+		for key, msg in ((b"key", b"one"), (b"key", b"two"), (b"other", b"one"), (b"", b"")):
+			with self.subTest(key=key, msg=msg):
+				expected = hmac.new(key, msg, hashlib.sha256).digest()
+				self.assertEqual(hmac_sha256(key, msg), expected)
+
+	def test_decode_signature(self):
+		"""Test only hex signatures of the expected size are decoded"""
+		digest = hmac_sha256(b"key", b"msg")
+		self.assertEqual(decode_signature(digest.hex()), digest)
+		self.assertEqual(decode_signature(digest.hex().upper()), digest)
+		self.assertEqual(decode_signature("ab" * 16, size=16), bytes([0xAB]) * 16)
+		
+		cases = (
+			("too short", digest.hex()[:-2]),
+			("too long", digest.hex() + "00"),
+			("non-hex", "zz" + digest.hex()[2:]),
+			("empty", ""),
+			("None", None),
+			("bytes", digest),
+		)
+		for label, signature in cases:
+			with self.subTest(label):
+				self.assertIsNone(decode_signature(signature))
+
+
+class TestGatewaySignatures(unittest.TestCase):
+	"""Tests for gateway callback signature verification"""
+
+	def test_freedompay_signature(self):
+		"""Test FreedomPay callbacks verify against the f-string sign string"""
+		data = {
+			"merchant_id": "M1",
+			"terminal_id": 7,
+			"order_id": "ORD-1",
+			"amount": 150000,
+			"status": "success",
+		}
+		# transaction_id is missing, so it is signed as "None"
+		signature = _hmac_hex(SECRET_KEY, f"M17NoneORD-1150000success{SECRET_KEY}")
+		
+		self.assertTrue(_verify_freedompay_signature(data, signature, SECRET_KEY))
+		self.assertFalse(_verify_freedompay_signature({**data, "amount": 150001}, signature, SECRET_KEY))
+		self.assertFalse(_verify_freedompay_signature(data, signature[:-2], SECRET_KEY))
+		self.assertFalse(_verify_freedompay_signature(data, "zz" + signature[2:], SECRET_KEY))
+		self.assertFalse(_verify_freedompay_signature(data, signature, ""))
+
+	def test_payme_signature(self):
+		"""Test Payme callbacks verify against sorted JSON and the raw body"""
+		data = {"order_id": "ORD-1", "amount": 150000, "state": 2}
+		signature = _hmac_hex(SECRET_KEY, json.dumps(data, sort_keys=True))
+		
+		self.assertTrue(_verify_payme_signature(data, signature, SECRET_KEY))
+		self.assertFalse(_verify_payme_signature({**data, "state": 1}, signature, SECRET_KEY))
+		self.assertFalse(_verify_payme_signature(data, signature, "wrong"))
+		self.assertFalse(_verify_payme_signature(data, "not-hex", SECRET_KEY))
+		
+		raw_body = b'{"state":2,"order_id":"ORD-1","amount":150000}'
+		raw_signature = hmac.new(SECRET_KEY.encode("utf-8"), raw_body, hashlib.sha256).hexdigest()
+		self.assertTrue(_verify_payme_signature(data, raw_signature, SECRET_KEY, raw_body=raw_body))
+
+	def test_md5_hexdigest(self):
+		"""Test MD5 of joined parts matches hashlib.md5"""
+		parts = [b"123", "Тест".encode("utf-8"), b""]
+		self.assertEqual(_md5_hexdigest(parts), hashlib.md5(b"".join(parts)).hexdigest())
+
+	def test_click_signature(self):
+		"""Test Click callbacks verify against the f-string sign string"""
+		data = {
+			"click_trans_id": 555,
+			"service_id": "42",
+			"merchant_trans_id": "ORD-1",
+			"amount": "1000.00",
+			"action": 1,
+			"sign_time": "2026-10-15 12:00:00",
+		}
+		base = f"555{42}{SECRET_KEY}ORD-11000.001{data['sign_time']}"
+		cases = (
+			("no error", data, base),
+			("with error", {**data, "error": "-5017"}, base + "-5017"),
+			("zero error", {**data, "error": 0}, base),
+		)
+		for label, payload, sign_string in cases:
+			with self.subTest(label):
+				signed = {**payload, "sign_string": hashlib.md5(sign_string.encode("utf-8")).hexdigest()}
+				self.assertTrue(_verify_click_signature(signed, SECRET_KEY))
+				self.assertFalse(_verify_click_signature({**signed, "amount": "1000.01"}, SECRET_KEY))
+		
+		self.assertFalse(_verify_click_signature({**data, "sign_string": ""}, SECRET_KEY))
+		self.assertFalse(_verify_click_signature({**data, "sign_string": "x"}, ""))
+
+
+if __name__ == "__main__":
+	unittest.main()
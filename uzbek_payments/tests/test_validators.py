@@ -0,0 +1,71 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+Tests for input validators
+"""
+
+import unittest
+
+import frappe
+
+from uzbek_payments.validators import sanitize_payment_data, validate_order_id
+
+
+class TestValidators(unittest.TestCase):
+	"""Tests for input validators"""
+
+	def test_validate_order_id(self):
+		"""Test order IDs are limited to 1-100 ASCII alphanumerics, hyphens and underscores"""
+		cases = (
+			("plain", "ACC-PRQ-2026-00001", True),
+			("underscore", "order_1", True),
+			("100 characters", "a" * 100, True),
+			("101 characters", "a" * 101, False),
+			("cyrillic", "заказ-1", False),
+			("non-ascii digit", "ORD-١٢", False),
+			("trailing newline", "ORD-1\n", False),
+			("embedded newline", "ORD\n1", False),
+			("space", "ORD 1", False),
+			("empty", "", False),
+		)
+		for label, order_id, valid in cases:
+			with self.subTest(label):
+				if valid:
+					self.assertTrue(validate_order_id(order_id))
+				else:
+					with self.assertRaises(frappe.ValidationError):
+						validate_order_id(order_id)
+
+	def test_sanitize_payment_data(self):
+		"""Test control characters are stripped and values clamped to 1000 characters"""
+		cases = (
+			("str control characters", {"note": "a\x00b\x1fc\x85d"}, {"note": "abcd"}),
+			("str clamped", {"note": "x" * 1500}, {"note": "x" * 1000}),
+			("bytes control characters", {"raw": b"a\x00b\x7fc"}, {"raw": b"abc"}),
+			("bytes clamped", {"raw": b"y" * 1500}, {"raw": b"y" * 1000}),
+			("utf-8 bytes kept", {"raw": "Тошкент\n".encode("utf-8")}, {"raw": "Тошкент".encode("utf-8")}),
+		)
+		for label, data, expected in cases:
+			with self.subTest(label):
+				original = dict(data)
+				result = sanitize_payment_data(data)
+				self.assertEqual(result, expected)
+				self.assertIsNot(result, data)
+				self.assertEqual(data, original)
+
+	def test_sanitize_payment_data_unchanged(self):
+		"""Test clean data is returned as the same object"""
+		cases = (
+			("strings", {"order_id": "ORD-1", "note": "Тошкент"}),
+			("mixed", {"amount": 1000, "raw": b"abc", "paid": True, "extra": None}),
+			("empty", {}),
+			("frappe._dict", frappe._dict(order_id="ORD-1")),
+		)
+		for label, data in cases:
+			with self.subTest(label):
+				self.assertIs(sanitize_payment_data(data), data)
+
+
+if __name__ == "__main__":
+	unittest.main()
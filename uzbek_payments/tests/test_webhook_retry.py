@@ -0,0 +1,85 @@
+# Copyright (c) 2026, Viktor Krasnikov
+# License: MIT. See LICENSE
+
+"""
+Tests for the webhook retry queue
+"""
+
+import unittest
+from unittest.mock import call, patch
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+from frappe.utils import add_to_date, now_datetime
+
+from uzbek_payments.webhook_retry import RETRY_DOCTYPE, WebhookRetry, process_pending_retries
+
+IR_PREFIX = "_Test Retry IR"
+
+
+class TestWebhookRetry(FrappeTestCase):
+	"""Tests for scheduling and sweeping webhook retries"""
+
+	def setUp(self):
+		frappe.local.webhook_retries = None
+
+	def tearDown(self):
+		frappe.local.webhook_retries = None
+		frappe.db.delete(RETRY_DOCTYPE, {"integration_request": ["like", f"{IR_PREFIX}%"]})
+		frappe.db.commit()
+
+	def _queued(self):
+		return frappe.get_all(
+			RETRY_DOCTYPE,
+			filters={"integration_request": ["like", f"{IR_PREFIX}%"]},
+			fields=["integration_request", "retry_count"],
+			order_by="integration_request asc",
+		)
+
+	def test_schedule_retry_coalesces_per_request(self):
+		"""Test retries scheduled in one transaction are written once per Integration Request"""
+		WebhookRetry.schedule_retry(f"{IR_PREFIX} 1", 0)
+		WebhookRetry.schedule_retry(f"{IR_PREFIX} 1", 1)
+		self.assertEqual(self._queued(), [])
+
+		frappe.db.commit()
+
+		self.assertEqual(self._queued(), [{"integration_request": f"{IR_PREFIX} 1", "retry_count": 2}])
+
+	def test_rollback_discards_pending_retries(self):
+		"""Test a rollback drops pending retries and later retries are still written"""
+		WebhookRetry.schedule_retry(f"{IR_PREFIX} 1", 0)
+		frappe.db.rollback()
+		frappe.db.commit()
+		self.assertEqual(self._queued(), [])
+
+		WebhookRetry.schedule_retry(f"{IR_PREFIX} 2", 0)
+		frappe.db.commit()
+		self.assertEqual(self._queued(), [{"integration_request": f"{IR_PREFIX} 2", "retry_count": 1}])
+
+	@patch("uzbek_payments.webhook_retry.WebhookRetry.process_webhook_retry")
+	def test_process_pending_retries(self, mock_process):
+		"""Test each due retry is deleted and replayed exactly once"""
+		for suffix in ("1", "2", "later"):
+			WebhookRetry.schedule_retry(f"{IR_PREFIX} {suffix}", 0)
+		frappe.db.commit()
+
+		past = add_to_date(now_datetime(), minutes=-5)
+		for suffix in ("1", "2"):
+			frappe.db.set_value(
+				RETRY_DOCTYPE, {"integration_request": f"{IR_PREFIX} {suffix}"}, "next_retry_at", past
+			)
+		frappe.db.commit()
+
+		process_pending_retries()
+		process_pending_retries()
+
+		self.assertCountEqual(
+			mock_process.call_args_list,
+			[call(f"{IR_PREFIX} 1", 1), call(f"{IR_PREFIX} 2", 1)],
+		)
+		self.assertEqual(self._queued(), [{"integration_request": f"{IR_PREFIX} later", "retry_count": 1}])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -1,3 +1,3 @@
-from .utils import after_install, create_payment_gateway
+from .utils import after_install, after_migrate, create_custom_fields, create_payment_gateways
 
-__all__ = ["after_install", "create_payment_gateway"]
+__all__ = ["after_install", "after_migrate", "create_custom_fields", "create_payment_gateways"]
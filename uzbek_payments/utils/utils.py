@@ -1,35 +1,73 @@
 import frappe
 from frappe import _
 
+# Indexed fields on Integration Request used for equality lookups
+CUSTOM_FIELDS = {
+	"Integration Request": [
+		{
+			"fieldname": "idempotency_lookup",
+			"label": "Idempotency Lookup",
+			"fieldtype": "Data",
+			"insert_after": "integration_request_service",
+			"search_index": 1,
+			"read_only": 1,
+		},
+		{
+			"fieldname": "ext_order_id",
+			"label": "External Order ID",
+			"fieldtype": "Data",
+			"insert_after": "idempotency_lookup",
+			"search_index": 1,
+			"read_only": 1,
+		},
+		{
+			"fieldname": "ext_txn_id",
+			"label": "External Transaction ID",
+			"fieldtype": "Data",
+			"insert_after": "ext_order_id",
+			"search_index": 1,
+			"read_only": 1,
+		},
+	],
+}
+
+# Payment gateways registered on install: (gateway, settings doctype, controller)
+PAYMENT_GATEWAYS = (
+	("Payme", "Payme Settings", "PaymeSettings"),
+	("Click", "Click Settings", "ClickSettings"),
+	("FreedomPay", "FreedomPay Settings", "FreedomPaySettings"),
+)
+
 
 def after_install():
 	"""Called after app installation"""
+	create_custom_fields()
 	create_payment_gateways()
 
 
-def create_payment_gateways():
-	"""Create payment gateway records for Uzbek payment systems"""
-	from payments.utils import create_payment_gateway
+def after_migrate():
+	"""Called after site migration"""
+	from uzbek_payments.integrations import clear_module_cache
 
-	# Create Payme gateway
-	create_payment_gateway(
-		gateway="Payme",
-		settings="Payme Settings",
-		controller="PaymeSettings",
-	)
+	create_custom_fields()
+	clear_module_cache()
+	frappe.enqueue("uzbek_payments.idempotency.rebuild_idempotency_filters", queue="long")
 
-	# Create Click gateway
-	create_payment_gateway(
-		gateway="Click",
-		settings="Click Settings",
-		controller="ClickSettings",
-	)
 
-	# Create FreedomPay gateway
-	create_payment_gateway(
-		gateway="FreedomPay",
-		settings="FreedomPay Settings",
-		controller="FreedomPaySettings",
+def create_custom_fields():
+	"""Create custom fields required by Uzbek payment gateways"""
+	from frappe.custom.doctype.custom_field.custom_field import (
+		create_custom_fields as _create_custom_fields,
 	)
 
+	_create_custom_fields(CUSTOM_FIELDS, update=True)
+
+
+def create_payment_gateways():
+	"""Create payment gateway records for Uzbek payment systems"""
+	from payments.utils import create_payment_gateway
+
+	for gateway, settings, controller in PAYMENT_GATEWAYS:
+		create_payment_gateway(gateway=gateway, settings=settings, controller=controller)
+
 	frappe.msgprint(_("Uzbek payment gateways created successfully"))
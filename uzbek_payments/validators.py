@@ -11,6 +11,22 @@ from typing import Optional
 import frappe
 from frappe import _
 
+# ASCII only, as documented; \Z rather than $ so a trailing newline is not accepted
+_ORDER_ID_RE = re.compile(r'^[A-Za-z0-9_\-]{1,100}\Z')
+# Null bytes and C0/C1 control characters, removed by str.translate
+_CONTROL_CHARS = dict.fromkeys([*range(0x00, 0x20), *range(0x7f, 0xa0)])
+# Byte-level equivalent for raw values, removed by bytes.translate. C1 controls
+# are left out: bytes 0x80-0x9f are also UTF-8 continuation bytes.
+_CONTROL_BYTES = bytes([*range(0x00, 0x20), 0x7f])
+
+# Error messages are translated only inside the failing branches and stay
+# literal _() calls so translation extraction can find them; frappe caches
+# translations per language, so repeated failures are dictionary lookups
+
+# Payment amount bounds in UZS
+_MIN_AMOUNT = 1000  # 1000 UZS = 10.00
+_MAX_AMOUNT = 100_000_000  # 100,000,000 UZS = 1,000,000.00
+
 
 def validate_payment_amount(amount: float, currency: str = "UZS") -> bool:
 	"""
@@ -26,17 +42,15 @@ def validate_payment_amount(amount: float, currency: str = "UZS") -> bool:
 	if amount <= 0:
 		frappe.throw(_("Payment amount must be greater than 0"))
 	
-	# Minimum amount in UZS (1000 UZS = 10.00)
-	min_amount = 1000
-	if amount < min_amount:
-		frappe.throw(_("Payment amount must be at least {0} UZS").format(min_amount))
+	if amount < _MIN_AMOUNT:
+		frappe.throw(_("Payment amount must be at least {0} UZS").format(_MIN_AMOUNT))
 	
-	# Maximum amount in UZS (100,000,000 UZS = 1,000,000.00)
-	max_amount = 100000000
-	if amount > max_amount:
-		frappe.throw(_("Payment amount must not exceed {0} UZS").format(max_amount))
+	if amount > _MAX_AMOUNT:
+		frappe.throw(_("Payment amount must not exceed {0} UZS").format(_MAX_AMOUNT))
 	
-	# Check for reasonable precision (2 decimal places)
+	# Check for reasonable precision (2 decimal places). round() is kept on
+	# purpose: amount * 100 == int(amount * 100) rejects valid floats such
+	# as 10.07, whose product is 1007.0000000000001
 	if round(amount, 2) != amount:
 		frappe.throw(_("Payment amount must have at most 2 decimal places"))
 	
@@ -60,12 +74,11 @@ def validate_order_id(order_id: str) -> bool:
 	if not order_id:
 		frappe.throw(_("Order ID is required"))
 	
-	# Basic format validation
-	if len(order_id) > 100:
-		frappe.throw(_("Order ID must be less than 100 characters"))
-	
-	# Check for invalid characters (but don't modify - validation only)
-	if not re.match(r'^[\w\-_]+$', order_id):
+	# Length and characters in one bounded match (validation only, no changes);
+	# the specific reason is worked out only when it fails
+	if not _ORDER_ID_RE.match(order_id):
+		if len(order_id) > 100:
+			frappe.throw(_("Order ID must be less than 100 characters"))
 		frappe.throw(_("Order ID contains invalid characters. Only alphanumeric characters, hyphens and underscores are allowed."))
 	
 	return True
@@ -79,17 +92,24 @@ def sanitize_payment_data(data: dict) -> dict:
 		data: Payment data dictionary
 		
 	Returns:
-		Sanitized data
+		Sanitized data; data itself if nothing needed changing
 	"""
-	sanitized = {}
+	sanitized = None
 	
 	for key, value in data.items():
 		if isinstance(value, str):
-			# Remove null bytes and control characters
-			value = re.sub(r'[\x00-\x1f\x7f-\x9f]', '', value)
-			# Limit length
-			if len(value) > 1000:
-				value = value[:1000]
-		sanitized[key] = value
+			# Limit length first so oversized input is never scanned in full
+			clean = value[:1000].translate(_CONTROL_CHARS)
+		elif isinstance(value, bytes):
+			# Same rules on raw values, without decoding them
+			clean = value[:1000].translate(None, _CONTROL_BYTES)
+		else:
+			continue
+		
+		if clean != value:
+			# Copy only once a value actually changes
+			if sanitized is None:
+				sanitized = data.copy()
+			sanitized[key] = clean
 	
-	return sanitized
+	return data if sanitized is None else sanitized
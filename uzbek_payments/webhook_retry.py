@@ -7,14 +7,63 @@ Webhook retry mechanism for failed payment callbacks
 
 import frappe
 from datetime import datetime
-from typing import Dict, Any
+from functools import lru_cache
+from frappe.utils import add_to_date, now_datetime
+from typing import Dict, Any, Callable
+
+from uzbek_payments.db_utils import get_table_name, load_json_data
+
+# Queued retries, one row per Integration Request
+RETRY_DOCTYPE = "Integration Request Retry"
+
+# Flush coalesced retries early once this many are pending
+FLUSH_THRESHOLD = 64
+
+# Most due retries replayed by a single sweep
+SWEEP_BATCH_SIZE = 100
+
+# Callback entry points re-run by retries, by gateway name
+_CALLBACK_PATHS = {
+	"Payme": "uzbek_payments.payment_gateways.doctype.payme_settings.payme_settings.callback",
+	"Click": "uzbek_payments.payment_gateways.doctype.click_settings.click_settings.callback",
+	"FreedomPay": "uzbek_payments.payment_gateways.doctype.freedompay_settings.freedompay_settings.callback",
+}
+
+
+@lru_cache(maxsize=None)
+def _resolve_callback(gateway_name: str) -> Callable:
+	"""
+	Resolve a gateway's callback function once per process
+	
+	Raises:
+		KeyError: If the gateway is unknown
+	"""
+	return frappe.get_attr(_CALLBACK_PATHS[gateway_name])
+
+
+def _is_success(result: Dict[str, Any]) -> bool:
+	"""
+	Check a callback response for success in any gateway's format
+	
+	Payme nests the status under "result", Click reports error 0 and
+	FreedomPay returns a top-level status.
+	"""
+	if not result:
+		return False
+	nested = result.get("result")
+	return (
+		(isinstance(nested, dict) and nested.get("status") == "success")
+		or result.get("error") == 0
+		or result.get("status") == "success"
+	)
 
 
 class WebhookRetry:
 	"""Retry mechanism for failed webhooks"""
 
-	MAX_RETRIES = 3
-	RETRY_DELAYS = [60, 300, 900]  # 1 min, 5 min, 15 min
+	# One delay per retry, so MAX_RETRIES always indexes into RETRY_DELAYS
+	RETRY_DELAYS = (60, 300, 900)  # 1 min, 5 min, 15 min
+	MAX_RETRIES = len(RETRY_DELAYS)
 
 	@staticmethod
 	def schedule_retry(integration_request_name: str, retry_count: int = 0):
@@ -30,19 +79,66 @@ class WebhookRetry:
 				f"Webhook retry limit exceeded for {integration_request_name}",
 				"Webhook Retry Error"
 			)
+			# Drop any retry the replayed callback scheduled for itself
+			pending = getattr(frappe.local, "webhook_retries", None)
+			if pending:
+				pending.pop(integration_request_name, None)
+			frappe.db.delete(RETRY_DOCTYPE, {"integration_request": integration_request_name})
 			return
 
-		delay = WebhookRetry.RETRY_DELAYS[retry_count] if retry_count < len(WebhookRetry.RETRY_DELAYS) else 900
+		delay = WebhookRetry.RETRY_DELAYS[retry_count]
 
-		frappe.enqueue(
-			"uzbek_payments.webhook_retry.process_webhook_retry",
-			integration_request_name=integration_request_name,
-			retry_count=retry_count + 1,
-			queue="long",
-			timeout=300,
-			delay=delay
+		# Coalesce retries scheduled in this request or job and write them
+		# together just before the transaction commits. Keyed by name, so a
+		# replayed callback's own retry is superseded by the retry loop's.
+		pending = getattr(frappe.local, "webhook_retries", None)
+		if pending is None:
+			pending = frappe.local.webhook_retries = {}
+			frappe.db.before_commit.add(WebhookRetry.flush)
+			# A rollback drops the flush hook, so drop the pending retries too;
+			# the next retry then starts over and registers the hook again
+			frappe.db.after_rollback.add(WebhookRetry.discard_pending)
+		pending[integration_request_name] = (
+			retry_count + 1,
+			add_to_date(now_datetime(), seconds=delay),
+		)
+
+		if len(pending) >= FLUSH_THRESHOLD:
+			WebhookRetry.flush()
+
+	@staticmethod
+	def flush():
+		"""Write pending retries to the retry queue in one insert"""
+		pending = getattr(frappe.local, "webhook_retries", None)
+		if not pending:
+			return
+		# Reset so the next retry registers the commit hook again
+		frappe.local.webhook_retries = None
+
+		names = list(pending)
+		now = now_datetime()
+		user = frappe.session.user
+
+		# Replace any queued retry for the same Integration Request
+		frappe.db.delete(RETRY_DOCTYPE, {"integration_request": ("in", names)})
+		frappe.db.bulk_insert(
+			RETRY_DOCTYPE,
+			[
+				"name", "creation", "modified", "owner", "modified_by",
+				"integration_request", "retry_count", "next_retry_at",
+			],
+			[
+				(frappe.generate_hash(length=10), now, now, user, user, name, retry_count, next_retry_at)
+				for name, (retry_count, next_retry_at) in pending.items()
+			],
+			ignore_duplicates=True,
 		)
 
+	@staticmethod
+	def discard_pending():
+		"""Forget retries scheduled in a transaction that was rolled back"""
+		frappe.local.webhook_retries = None
+
 	@staticmethod
 	def process_webhook_retry(integration_request_name: str, retry_count: int):
 		"""
@@ -53,7 +149,19 @@ class WebhookRetry:
 			retry_count: Current retry count
 		"""
 		try:
-			ir = frappe.get_doc("Integration Request", integration_request_name)
+			# Plain row read; the full document is never needed here
+			ir = frappe.db.get_value(
+				"Integration Request",
+				integration_request_name,
+				["status", "integration_request_service", "data"],
+				as_dict=True,
+			)
+			if not ir:
+				frappe.log_error(
+					f"Integration Request {integration_request_name} not found for retry",
+					"Webhook Retry Error"
+				)
+				return
 			
 			if ir.status == "Completed":
 				# Already processed, no need to retry
@@ -63,19 +171,9 @@ class WebhookRetry:
 			gateway_name = ir.integration_request_service
 			
 			# Get callback function
-			if gateway_name == "Payme":
-				callback_func = frappe.get_attr(
-					"uzbek_payments.payment_gateways.doctype.payme_settings.payme_settings.callback"
-				)
-			elif gateway_name == "Click":
-				callback_func = frappe.get_attr(
-					"uzbek_payments.payment_gateways.doctype.click_settings.click_settings.callback"
-				)
-			elif gateway_name == "FreedomPay":
-				callback_func = frappe.get_attr(
-					"uzbek_payments.payment_gateways.doctype.freedompay_settings.freedompay_settings.callback"
-				)
-			else:
+			try:
+				callback_func = _resolve_callback(gateway_name)
+			except KeyError:
 				frappe.log_error(
 					f"Unknown gateway for retry: {gateway_name}",
 					"Webhook Retry Error"
@@ -83,7 +181,7 @@ class WebhookRetry:
 				return
 			
 			# Reconstruct callback data from integration request
-			data = frappe.parse_json(ir.data)
+			data = load_json_data(ir.data)
 			if not data:
 				frappe.log_error(
 					f"Invalid or empty data in Integration Request {integration_request_name}",
@@ -91,24 +189,20 @@ class WebhookRetry:
 				)
 				return
 			
-			# Set form_dict for callback processing
-			if not hasattr(frappe.local, 'form_dict'):
-				frappe.local.form_dict = {}
-			frappe.local.form_dict.update(data)
-			
-			# Process callback
-			result = callback_func()
+			# Replay with this request's data only; a sweep replays many
+			# retries in one job, so keys must not leak between them
+			form_dict = getattr(frappe.local, "form_dict", None)
+			frappe.local.form_dict = frappe._dict(data)
+			try:
+				result = callback_func()
+			finally:
+				frappe.local.form_dict = form_dict
 			
 			# Check result
-			if result and (
-				result.get("result", {}).get("status") == "success" or
-				result.get("error") == 0 or
-				result.get("status") == "success"
-			):
-				# Success - update integration request
-				ir.status = "Completed"
-				ir.save(ignore_permissions=True)
-				frappe.db.commit()
+			if _is_success(result):
+				# Success - update integration request; committed by the caller
+				# together with the removal of the queued retry
+				frappe.db.set_value("Integration Request", integration_request_name, "status", "Completed")
 			else:
 				# Still failed - schedule another retry
 				WebhookRetry.schedule_retry(integration_request_name, retry_count)
@@ -119,3 +213,32 @@ class WebhookRetry:
 				"Webhook Retry Error"
 			)
 			WebhookRetry.schedule_retry(integration_request_name, retry_count)
+
+
+def process_pending_retries():
+	"""
+	Replay webhooks whose retry is due
+	
+	Runs from the scheduler every minute. Each due row is claimed with
+	FOR UPDATE SKIP LOCKED, deleted and replayed in its own transaction, so
+	concurrent sweeps never replay the same retry and an interrupted sweep
+	leaves the unprocessed rows queued.
+	"""
+	query = f"""
+		SELECT name, integration_request, retry_count
+		FROM {get_table_name(f"tab{RETRY_DOCTYPE}")}
+		WHERE next_retry_at <= %s
+		ORDER BY next_retry_at
+		LIMIT 1
+		FOR UPDATE SKIP LOCKED
+	"""
+
+	for _ in range(SWEEP_BATCH_SIZE):
+		due = frappe.db.sql(query, (now_datetime(),), as_dict=True)
+		if not due:
+			return
+
+		row = due[0]
+		frappe.db.delete(RETRY_DOCTYPE, {"name": row.name})
+		WebhookRetry.process_webhook_retry(row.integration_request, row.retry_count)
+		frappe.db.commit()